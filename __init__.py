@@ -2,6 +2,7 @@ from typing import Any
 
 from .toml_prompt.toml_prompt_decode import (
     PromptDecode,
+    PromptDecodeBatch,
     SummaryReader,
     SplitLoraList,
 )
@@ -32,6 +33,7 @@ from .toml_prompt.wrapper import (
 NODE_CLASS_MAPPINGS: dict[str, Any] = {
     "PromptDecode": PromptDecode,
     "TomlPromptDecode": PromptDecode,
+    "PromptDecodeBatch": PromptDecodeBatch,
     "MultipartCLIPTextEncode": MultipartCLIPTextEncode,
     "MultipleLoraTagLoader": MultipleLoraTagLoader,
     "PromptLoader": PromptLoader,
@@ -58,6 +60,7 @@ NODE_CLASS_MAPPINGS: dict[str, Any] = {
 NODE_DISPLAY_NAME_MAPPINGS = {
     "PromptDecode": "PromptDecode",
     "TomlPromptDecode": "PromptDecode",
+    "PromptDecodeBatch": "PromptDecodeBatch",
     "MultipartCLIPTextEncode": "MultipartCLIPTextEncode",
     "MultipleLoraTagLoader": "MultipleLoraTagLoader",
     "PromptLoader": "PromptLoader",
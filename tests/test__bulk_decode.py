@@ -0,0 +1,112 @@
+import io
+import os
+import csv
+import json
+import time
+import tempfile
+import unittest
+import contextlib
+from toml_prompt.inner.cache import prompt_dict_cache
+from toml_prompt.inner.prompt import PromptFile
+from toml_prompt.toml_prompt_decode import PromptDecode
+from toml_prompt.bulk_decode import FIELDS, main, report_progress, save_checkpoint
+
+
+class TestBulkDecode(unittest.TestCase):
+    def setUp(self):
+        prompt_dict_cache.clear()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "main.toml")
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(
+                '[a]\n_t = "x, {p|q|r}, $c"\nc = ["c1", "c2", "c3"]\n'
+                '[b]\n_t = "<neg>n</neg>, <lora:l.safetensors:0.5>"\n'
+                '[_exports]\nk = "値"\n'
+            )
+        self.keys = "a, {b|a}"
+        self.out = os.path.join(self.tmpdir.name, "out")
+        self.checkpoint = os.path.join(self.tmpdir.name, "ckpt.json")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_cli(self, *args: str):
+        argv = [self.path, "-k", self.keys, "-o", self.out, *args]
+        with contextlib.redirect_stderr(io.StringIO()):
+            assert main(argv) == 0
+        with open(self.out, "rb") as f:
+            return f.read()
+
+    def expected(self, seeds: list[int]):
+        prompt = PromptFile(self.path)
+        return [PromptDecode().load_prompt(s, prompt, self.keys) for s in seeds]
+
+    def test__jsonl(self):
+        data = self.run_cli("--seed", "5", "-n", "7", "--stride", "3", "-j", "1")
+        rows = [json.loads(line) for line in data.decode("utf-8").splitlines()]
+        assert [tuple(r[k] for k in FIELDS) for r in rows] == self.expected(
+            [5 + i * 3 for i in range(7)]
+        )
+
+    def test__workers(self):
+        args = ("-n", "20", "--chunk-size", "3")
+        single = self.run_cli(*args, "-j", "1")
+        assert self.run_cli(*args, "-j", "2") == single
+
+    def test__csv(self):
+        data = self.run_cli("-n", "4", "-f", "csv", "-j", "1")
+        rows = list(csv.reader(io.StringIO(data.decode("utf-8"), newline="")))
+        assert tuple(rows[0]) == FIELDS
+        expected = self.expected([0, 1, 2, 3])
+        assert [tuple(r) for r in rows[1:]] == [
+            tuple(str(v) for v in r) for r in expected
+        ]
+
+    def test__resume(self):
+        args = ("-n", "9", "--chunk-size", "2", "-j", "1")
+        full = self.run_cli(*args)
+        self.run_cli(*args, "--checkpoint", self.checkpoint)
+        with open(self.checkpoint, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        assert state["done"] == 9 and state["offset"] == len(full)
+
+        # 4件書いた後、書きかけの行を残して中断した状態から再開する
+        offset = len(b"".join(full.splitlines(keepends=True)[:4]))
+        save_checkpoint(self.checkpoint, state["job"], 4, offset)
+        with open(self.out, "wb") as f:
+            f.write(full[: offset + 10])
+        assert self.run_cli(*args, "--checkpoint", self.checkpoint) == full
+
+        with self.assertRaises(SystemExit):
+            self.run_cli("-n", "10", "-j", "1", "--checkpoint", self.checkpoint)
+
+        # 出力が消えた、または記録より短い場合は再開しない
+        save_checkpoint(self.checkpoint, state["job"], 4, offset)
+        for data in [None, full[: offset - 1]]:
+            if data is None:
+                os.remove(self.out)
+            else:
+                with open(self.out, "wb") as f:
+                    f.write(data)
+            with self.assertRaises(SystemExit):
+                self.run_cli(*args, "--checkpoint", self.checkpoint)
+            assert data is None or os.path.getsize(self.out) == len(data)
+
+    def test__decode_error(self):
+        # デコード中の例外は引数エラーにしない
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write('[a]\n_t = "<random x=bad><when key=x>y</when></random>"\n')
+        with self.assertRaises(ValueError):
+            self.run_cli("-n", "1", "-j", "1")
+
+    def test__progress(self):
+        # 再開前に終わっていた分は速度に含めない
+        err = io.StringIO()
+        with contextlib.redirect_stderr(err):
+            report_progress(110, 200, 100, time.perf_counter() - 1.0)
+        rate = float(err.getvalue().split("(")[1].split("/s")[0])
+        assert err.getvalue().startswith("\r110/200 seeds") and 5.0 < rate <= 10.0
+
+
+if __name__ == "__main__":
+    unittest.main()
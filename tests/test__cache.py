@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+from toml_prompt.inner.cache import LRUCache, prompt_dict_cache
+from toml_prompt.inner.prompt import PromptFile
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        prompt_dict_cache.clear()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "prompt.toml")
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write('[a]\n_t = "a"\n')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test__lru_evict(self):
+        c = LRUCache(max_bytes=10)
+        c.put("a", 1, 4)
+        c.put("b", 2, 4)
+        assert c.get("a") == 1
+        c.put("c", 3, 4)
+        assert "a" in c and "b" not in c and "c" in c
+        assert c.total_bytes == 8
+        c.put("d", 4, 11)
+        assert "d" not in c
+
+    def test__shared_parse(self):
+        d1 = PromptFile(self.path).load_shared()
+        d2 = PromptFile(self.path).load_shared()
+        assert d1 is d2
+        assert prompt_dict_cache.misses == 1
+
+    def test__load_is_private(self):
+        d = PromptFile(self.path).load()
+        d["a"]["_t"] = "b"
+        assert PromptFile(self.path).load()["a"]["_t"] == "a"
+
+    def test__invalidate_on_change(self):
+        d1 = PromptFile(self.path).load_shared()
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write('[a]\n_t = "changed"\n')
+        d2 = PromptFile(self.path).load_shared()
+        assert d1 is not d2
+        assert d2["a"]["_t"] == "changed"
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import itertools
+import os
+import tempfile
+import unittest
+from toml_prompt.inner.cache import prompt_dict_cache
+from toml_prompt.inner.prompt import PromptFile
+from toml_prompt.toml_prompt_decode import (
+    PromptDecode,
+    PromptDecodeBatch,
+    batch_seeds,
+    iter_decode,
+)
+
+
+class TestDecodeBatch(unittest.TestCase):
+    def setUp(self):
+        prompt_dict_cache.clear()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmpdir.name, "main.toml")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(
+                '[a]\n_t = "x, {p|q|r}, $c"\nc = ["c1", "c2", "c3"]\n'
+                '[b]\n_t = "<neg>n</neg>, <lora:l.safetensors:0.5>"\n'
+                '[_exports]\nk = "v"\n'
+            )
+        self.prompt = PromptFile(path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test__seeds(self):
+        assert batch_seeds(10, 3, 5) == [10, 15, 20]
+        assert batch_seeds(0xFFFFFFFFFFFFFFFF, 2, 1) == [0xFFFFFFFFFFFFFFFF, 0]
+
+    def test__same_as_single(self):
+        keys = "a, {b|a}"
+        r = PromptDecodeBatch().load_prompts(3, 4, 7, self.prompt, keys)
+        expected = [
+            PromptDecode().load_prompt(s, self.prompt, keys) for s in [3, 10, 17, 24]
+        ]
+        assert len(r) == len(PromptDecodeBatch.RETURN_TYPES)
+        assert all(isinstance(v, list) and len(v) == 4 for v in r)
+        assert [tuple(v) for v in zip(*r)] == expected
+        assert r[3] == [3, 10, 17, 24]
+
+    def test__iter_decode(self):
+        keys = "a, {b|a}"
+        expected = [PromptDecode().load_prompt(s, self.prompt, keys) for s in range(5)]
+        r = [x.to_tuple() for x in iter_decode(self.prompt.path, keys, range(5))]
+        assert r == expected
+
+        # シードは必要な分だけ読まれる
+        read: list[int] = []
+
+        def seeds():
+            for s in itertools.count():
+                read.append(s)
+                yield s
+
+        it = iter_decode(self.prompt, keys, seeds())
+        first = next(it)
+        assert first.seed == 0 and first.positive == expected[0][0]
+        assert [x.seed for x in itertools.islice(it, 2)] == [1, 2]
+        it.close()
+        assert read == [0, 1, 2]
+
+
+if __name__ == "__main__":
+    unittest.main()
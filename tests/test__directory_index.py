@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+from toml_prompt.inner.directory_index import DirectoryIndex
+
+
+class TestDirectoryIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+        os.makedirs(os.path.join(self.root, "sub", "deep"))
+        for p in ["a.toml", "sub/a.toml", "sub/deep/b.yaml", "sub/c.json"]:
+            with open(os.path.join(self.root, p), "w", encoding="utf-8") as f:
+                f.write("")
+        self.index_dir = tempfile.TemporaryDirectory()
+        self.index_path = os.path.join(self.index_dir.name, ".index.json")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        self.index_dir.cleanup()
+
+    def create(self):
+        return DirectoryIndex(self.root, (".toml", ".yaml"), self.index_path)
+
+    def test__relative_paths(self):
+        r = self.create().refresh()
+        assert r == ["a.toml", "sub/a.toml", "sub/deep/b.yaml"]
+
+    def test__rescan_changed_only(self):
+        index = self.create()
+        index.refresh()
+        scanned: list[str] = []
+        scan_dir = index.scan_dir
+        index.scan_dir = lambda rel, mtime_ns: scanned.append(rel) or scan_dir(
+            rel, mtime_ns
+        )
+        assert index.refresh() == ["a.toml", "sub/a.toml", "sub/deep/b.yaml"]
+        assert scanned == []
+        with open(os.path.join(self.root, "sub", "deep", "d.toml"), "w") as f:
+            f.write("")
+        r = index.refresh()
+        assert scanned == ["sub/deep"]
+        assert "sub/deep/d.toml" in r
+
+    def test__persistent(self):
+        self.create().refresh()
+        index = self.create()
+        assert "sub" in index.dirs
+        assert index.refresh() == ["a.toml", "sub/a.toml", "sub/deep/b.yaml"]
+
+    def test__resolve(self):
+        index = self.create()
+        index.refresh()
+        assert index.resolve("a.toml") == "a.toml"
+        assert index.resolve("b.yaml") == "sub/deep/b.yaml"
+
+    def test__symlink(self):
+        os.symlink("..", os.path.join(self.root, "sub", "loop"))
+        os.symlink("sub", os.path.join(self.root, "link"))
+        r = self.create().refresh()
+        assert r == ["a.toml", "sub/a.toml", "sub/deep/b.yaml"]
+
+
+if __name__ == "__main__":
+    unittest.main()
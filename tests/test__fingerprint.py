@@ -0,0 +1,79 @@
+import os
+import hashlib
+import tempfile
+import unittest
+from toml_prompt.inner.cache import prompt_dict_cache
+from toml_prompt.inner.prompt import PromptFile
+from toml_prompt.inner.fingerprint import FingerprintService
+
+
+class TestFingerprint(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "prompt.toml")
+        self.wild = os.path.join(self.tmpdir.name, "wild.txt")
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write('[a]\nb = { _load_from_file = "wild.txt" }\n')
+        with open(self.wild, "w", encoding="utf-8") as f:
+            f.write("x\ny\n")
+        self.service = FingerprintService()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test__dependencies(self):
+        r = self.service.get_dependencies(self.path)
+        assert r == [
+            (os.path.join(os.path.realpath(self.tmpdir.name), "wild.txt"), False)
+        ]
+
+    def test__stat_first(self):
+        self.service.digest(self.path)
+        key, _ = self.service.digests[os.path.realpath(self.path)]
+        self.service.digests[os.path.realpath(self.path)] = (key, "cached")
+        assert self.service.digest(self.path) == "cached"
+
+    def test__dependency_change(self):
+        r1 = self.service.fingerprint(self.path)
+        assert self.service.fingerprint(self.path) == r1
+        with open(self.wild, "w", encoding="utf-8") as f:
+            f.write("x\ny\nz\n")
+        assert self.service.fingerprint(self.path) != r1
+        os.remove(self.wild)
+        assert self.service.fingerprint(self.path) != r1
+
+    def test__include_change(self):
+        shard = os.path.join(self.tmpdir.name, "shard.toml")
+        with open(shard, "w", encoding="utf-8") as f:
+            f.write('a = "a"\n')
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write('[c]\n_include = "shard.toml"\n')
+        r1 = self.service.fingerprint(self.path)
+        with open(shard, "w", encoding="utf-8") as f:
+            f.write('a = "b"\n')
+        assert self.service.fingerprint(self.path) != r1
+
+    def test__read_once(self):
+        # 依存関係の解析で読んだ内容のハッシュをdigestでも使う
+        self.service.get_dependencies(self.path)
+        with open(self.path, "rb") as f:
+            expected = hashlib.sha256(f.read()).hexdigest()
+        assert self.service.digests[os.path.realpath(self.path)][1] == expected
+        assert self.service.digest(self.path) == expected
+
+    def test__syntax_error(self):
+        prompt_dict_cache.clear()
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("[a\n")
+        r1 = self.service.fingerprint(self.path)
+        assert self.service.get_dependencies(self.path) == []
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("[a]]\n")
+        assert self.service.fingerprint(self.path) != r1
+        # エラーはファイルを読み込むときに報告される
+        with self.assertRaises(Exception):
+            PromptFile(self.path).load_library()
+
+
+if __name__ == "__main__":
+    unittest.main()
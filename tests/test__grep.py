@@ -0,0 +1,90 @@
+import os
+import re
+import tempfile
+import unittest
+from toml_prompt.inner.cache import grep_cache, prompt_dict_cache
+from toml_prompt.inner.grep import GrepTermError, compile_grep, grep_values
+from toml_prompt.inner.prompt import PromptFile
+from toml_prompt.inner.parser import PromptTagParser
+from toml_prompt.inner.overlay import PromptOverlay
+from toml_prompt.inner.wildcard import WildcardFile
+
+
+class TestGrep(unittest.TestCase):
+    def setUp(self):
+        grep_cache.clear()
+        self.values = ["dark", "dark blue", "light blue", "Red", "a\nb", "1"]
+
+    def grep(self, *terms: str) -> list[str]:
+        return grep_values(self.values, terms, False)
+
+    def test__substring(self):
+        assert self.grep("ark") == ["dark", "dark blue"]
+        assert self.grep("a.") == []
+        assert self.grep("") == self.values
+
+    def test__regex(self):
+        assert self.grep("/^d/") == ["dark", "dark blue"]
+        assert self.grep("/blue$/") == ["dark blue", "light blue"]
+        assert self.grep("/red/i") == ["Red"]
+        assert self.grep("/a.b/") == []
+        assert self.grep("/a.b/s") == ["a\nb"]
+        for p in ["^b", "b$", "(?<=a)r", "\\d", "a|e"]:
+            expected = [v for v in self.values if re.search(p, v)]
+            assert self.grep(f"/{p}/") == expected, p
+
+    def test__multiple_terms(self):
+        assert self.grep("blue", "!dark") == ["light blue"]
+        assert self.grep("/^[a-z]/", "!/ /", "!1") == ["dark", "a\nb"]
+        assert self.grep("!") == []
+        assert compile_grep(("a", "b")) is compile_grep(("a", "b"))
+
+    def test__cache(self):
+        r1 = grep_values(self.values, ("blue",), True)
+        r2 = grep_values(self.values, ("blue",), True)
+        assert r1 == r2 == ["dark blue", "light blue"]
+        # 書き換えられてもキャッシュに影響しない
+        assert r1 is not r2
+        assert len(grep_cache) == 1
+        grep_values(list(self.values), ("blue",), True)
+        assert len(grep_cache) == 2
+
+    def test__wildcard(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "colors.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("dark\n# comment\n  dark blue \r\n\nlight blue")
+            WildcardFile.persist_index = False
+            try:
+                w = WildcardFile(path)
+            finally:
+                WildcardFile.persist_index = True
+            assert w.read_all() == list(w)
+            assert grep_values(w, ("ark",), True) == ["dark", "dark blue"]
+
+    def test__is_shared(self):
+        base = {"a": {"b": ["x"]}, "c": ["y"]}
+        overlay = PromptOverlay(base)
+        assert overlay.is_shared(["a", "b"], overlay.root["a"]["b"])
+        assert overlay.is_shared(["c"], overlay.root["c"])
+        overlay.writable([])["c"] = ["z"]
+        assert not overlay.is_shared(["c"], overlay.root["c"])
+        assert not overlay.is_shared(["d"], None)
+
+    def test__invalid_regex(self):
+        with self.assertRaises(GrepTermError) as cm:
+            self.grep("ark", "!/[x/i")
+        assert cm.exception.term == "!/[x/i"
+
+        prompt_dict_cache.clear()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "main.toml")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write('[a]\nc = ["x", "y"]\n')
+            parser = PromptTagParser(prompt=PromptFile(path), seed=0)
+            with self.assertRaisesRegex(Exception, re.escape("key=a.c, term=/[x/")):
+                parser.feed("<?grep a.c /[x/>")
+
+
+if __name__ == "__main__":
+    unittest.main()
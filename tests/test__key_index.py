@@ -0,0 +1,31 @@
+import unittest
+from toml_prompt.inner.key_index import KeyPathIndex
+from toml_prompt.inner.node_index import NodeIndex
+from toml_prompt.inner.prompt import find_keys
+
+
+class TestKeyIndex(unittest.TestCase):
+    def test__find(self):
+        paths = ["a.girl", "a.boy", "b.girl.hat", "b.glasses", "girl"]
+        index = KeyPathIndex(paths)
+        assert index.find("girl") == ["a.girl", "b.girl.hat", "girl"]
+        assert index.find("gl") == ["b.glasses"]
+        assert index.find("") == paths
+        assert index.find("cat") == []
+        assert len(index) == 5
+
+    def test__find_keys(self):
+        d = {
+            "a": {"_t": "a", "girl": "girl", "boy": "boy"},
+            "girls": {"x": "x"},
+        }
+        index = NodeIndex()
+        assert find_keys(d, "girl", index=index) == ["a.girl", "girls.x"]
+        meta = index.get(d)
+        assert meta.paths is not None
+        assert find_keys(d, "a", index=index) == ["a.girl", "a.boy", "a"]
+        assert index.get(d).paths is meta.paths
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+from toml_prompt.inner.loaded_keys import KeyInterner, LoadedKeys
+from toml_prompt.inner.cache import prompt_dict_cache
+from toml_prompt.inner.prompt import PromptFile, collect_prompt
+from toml_prompt.inner.parser import PromptTagParser
+from toml_prompt.inner.util import Random
+
+
+class TestLoadedKeys(unittest.TestCase):
+    def test__set(self):
+        interner = KeyInterner()
+        keys = LoadedKeys(["a.b", "c"], interner=interner)
+        shared = keys
+        keys += ["a", "c"]
+        assert shared is keys
+        assert list(keys) == ["a.b", "c", "a"]
+        assert len(keys) == 3
+        assert "a" in keys and "a.b" in keys
+        assert "b" not in keys and None not in keys
+        assert interner.intern("a.b") == 0
+        assert keys == ["a.b", "c", "a"]
+
+    def test__collect_prompt(self):
+        d = {"a": {"_t": "a", "b": {"_when": "c", "_t": "b"}}, "c": "c"}
+        keys = LoadedKeys()
+        r = collect_prompt(Random(0), d, "a.*", exclude_keys=keys)
+        assert r == ["a"]
+        r = collect_prompt(Random(0), d, "c", exclude_keys=keys)
+        r += collect_prompt(Random(0), d, "a.*", exclude_keys=keys)
+        assert r == ["c", "b"]
+        assert list(keys) == ["a", "c", "a.b"]
+
+    def test__library_interner(self):
+        # キーのIDはライブラリごとに持ち、他のライブラリに残らない
+        prompt_dict_cache.clear()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            parsers: list[PromptTagParser] = []
+            for name in ["x", "y"]:
+                path = os.path.join(tmpdir, f"{name}.toml")
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(f'[{name}]\n_t = "{name}"\n')
+                parser = PromptTagParser(prompt=PromptFile(path), seed=0)
+                parser.feed(name)
+                parsers += [parser]
+            x, y = [p.loaded_keys.interner for p in parsers]
+            assert x is not y
+            assert x.keys == ["x"] and y.keys == ["y"]
+            library = PromptFile(os.path.join(tmpdir, "x.toml")).load_library()
+            assert library.key_interner is x
+        assert LoadedKeys().interner is not LoadedKeys().interner
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import time
+import tempfile
+import unittest
+from toml_prompt.inner.util import Random
+from toml_prompt.inner.cache import prompt_dict_cache
+from toml_prompt.inner.mount import MountedDict
+from toml_prompt.inner.prompt import PromptFile, build_search_keys, collect_prompt
+
+
+class TestMount(unittest.TestCase):
+    def setUp(self):
+        prompt_dict_cache.clear()
+        self.random = Random(seed=None)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+        os.makedirs(os.path.join(self.root, "chars", "sub"))
+        self.write("main.toml", '[a]\n_t = "a"\n[chars]\n_include = "chars/"\n')
+        self.write("chars/alice.toml", '_t = "alice"\nhair = "blonde"\n')
+        self.write("chars/bob.yaml", "_t: bob\n")
+        self.write("chars/sub/carol.toml", '_t = "carol"\n')
+        self.path = os.path.join(self.root, "main.toml")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name: str, text: str):
+        with open(os.path.join(self.root, name), "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def test__lazy(self):
+        d = PromptFile(self.path).load_shared()
+        chars = dict.__getitem__(d, "chars")
+        assert isinstance(chars, MountedDict) and not chars.loaded
+        r = collect_prompt(self.random, d, build_search_keys("chars.alice.hair"))
+        assert r == ["alice", "blonde"]
+        assert chars.loaded
+        assert not dict.__getitem__(chars, "bob").loaded
+
+    def test__directory(self):
+        d = PromptFile(self.path).load_shared()
+        r = collect_prompt(self.random, d, build_search_keys("chars.bob+sub.carol"))
+        assert r == ["bob", "carol"]
+        assert sorted(d["chars"].keys()) == ["_include", "alice", "bob", "sub"]
+
+    def test__stale(self):
+        d = PromptFile(self.path).load_shared()
+        collect_prompt(self.random, d, build_search_keys("chars.alice"))
+        time.sleep(0.01)
+        self.write("chars/alice.toml", '_t = "alice2"\n')
+        d = PromptFile(self.path).load_shared()
+        r = collect_prompt(self.random, d, build_search_keys("chars.alice"))
+        assert r == ["alice2"]
+
+
+if __name__ == "__main__":
+    unittest.main()
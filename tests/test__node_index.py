@@ -0,0 +1,55 @@
+from typing import Any
+
+import unittest
+from toml_prompt.inner.node_index import NodeIndex, DecodeNodeIndex
+from toml_prompt.inner.overlay import PromptOverlay
+from toml_prompt.inner.prompt import get_keys_all, get_keys_term
+
+
+class TestNodeIndex(unittest.TestCase):
+    def setUp(self):
+        self.d: dict[str, Any] = {
+            "a": {
+                "_t": "a",
+                "_post": ["::b"],
+                "b": {"_when": "x", "_t": "b"},
+                "c": {"_when_not": "x", "d": "d"},
+                "e": "e",
+            }
+        }
+
+    def test__meta(self):
+        index = NodeIndex()
+        meta = index.get(self.d["a"])
+        assert meta.keys == [(0, "b"), (1, "c"), (2, "e")]
+        assert meta.has_t
+        assert meta.post == ["::b"]
+        assert index.get(self.d["a"]) is meta
+        assert index.is_term(self.d["a"]["b"])
+        assert not index.is_term(self.d["a"]["c"])
+
+    def test__when(self):
+        index = NodeIndex()
+        a = self.d["a"]
+        assert get_keys_all(a, loaded_keys=[], index=index) == [(1, "c"), (2, "e")]
+        assert get_keys_all(a, loaded_keys=["x"], index=index) == [(0, "b"), (2, "e")]
+        assert get_keys_term(a, True, loaded_keys=["x"], index=index) == [
+            (0, "b"),
+            (2, "e"),
+        ]
+
+    def test__invalidate(self):
+        base = NodeIndex()
+        overlay = PromptOverlay(self.d)
+        index = DecodeNodeIndex(base, overlay)
+        assert not index.is_term(overlay.root["a"]["c"])
+        c = overlay.writable(["a", "c"])
+        assert not index.is_term(c)
+        c["_k"] = []
+        index.invalidate()
+        assert index.is_term(c)
+        assert not base.is_term(self.d["a"]["c"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import re
+import random
+import unittest
+from toml_prompt.inner.normalize import (
+    normalize_prompt,
+    split_tags,
+    dedupe_tags,
+    PromptFragments,
+)
+
+
+def normalize_prompt_regex(s: str):
+    s = re.sub(r"\s+", " ", s)
+    s = re.sub(r", ", ",", s)
+    s = re.sub(r",+", ",", s)
+    s = re.sub(r"\.,", ".", s)
+    return s[1:] if s.startswith(",") else s
+
+
+class TestNormalize(unittest.TestCase):
+    def test__same_as_regex(self):
+        g = random.Random(0)
+        alphabet = [" ", ",", ".", "a", "b", "\n", "\t", "　", "\x85", ", "]
+        alphabet += [" ,", "\r\n", "..", ",.", "("]
+        for _ in range(20000):
+            s = "".join(g.choice(alphabet) for _ in range(g.randint(0, 14)))
+            assert normalize_prompt(s) == normalize_prompt_regex(s), repr(s)
+
+    def test__split_tags(self):
+        assert split_tags("a,(b, c:1.2),[d,e],f") == ["a", "(b, c:1.2)", "[d,e]", "f"]
+        assert split_tags("a),b") == ["a)", "b"]
+
+    def test__dedupe(self):
+        assert dedupe_tags("a,b,a ,(a, b),c,b,(a, b)") == "a,b,(a, b),c"
+        assert normalize_prompt("x, y,\n x, z. , y", dedupe=True) == "x,y,z. "
+
+    def test__fragments(self):
+        f = PromptFragments()
+        f.append(" a ")
+        f.extend_last("b")
+        f += ["  ", "c, a"]
+        assert f == [" a b", "  ", "c, a"]
+        assert len(f) == 3
+        assert f.build() == "a b,c,a"
+        assert f.build(dedupe=True) == "a b,c,a"
+        assert PromptFragments(["a", "b, a"]).build(dedupe=True) == "a,b"
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+from typing import Any
+
+import unittest
+from toml_prompt.inner.overlay import PromptOverlay
+from toml_prompt.inner.parser import fix_route, remove_route
+
+
+class TestOverlay(unittest.TestCase):
+    def setUp(self):
+        self.base: dict[str, Any] = {
+            "a": {
+                "b": {"c": "c", "d": "d"},
+                "e": {"f": "f"},
+            },
+            "g": {"h": "h"},
+        }
+
+    def test__writable(self):
+        overlay = PromptOverlay(self.base)
+        d = overlay.writable(["a", "b"])
+        d["c"] = ["x"]
+        assert overlay.root["a"]["b"]["c"] == ["x"]
+        assert self.base["a"]["b"]["c"] == "c"
+        # 書き込まれていない部分木はベースを共有する
+        assert overlay.root["a"]["e"] is self.base["a"]["e"]
+        assert overlay.root["g"] is self.base["g"]
+        assert overlay.delta_size() == 3
+
+    def test__fix_route(self):
+        overlay = PromptOverlay(self.base)
+        d = overlay.writable(["a"])
+        fix_route(overlay, d, ["b.c"])
+        assert overlay.root["a"]["_k"] == ["b"]
+        assert overlay.root["a"]["b"]["_k"] == ["c"]
+        assert "_k" not in self.base["a"]
+        assert "_k" not in self.base["a"]["b"]
+
+    def test__remove_route(self):
+        self.base["a"]["_k"] = ["b", "e"]
+        self.base["a"]["_w"] = [1.0, 2.0]
+        overlay = PromptOverlay(self.base)
+        d = overlay.writable(["a"])
+        remove_route(overlay, d, ["b"])
+        assert overlay.root["a"]["_k"] == ["e"]
+        assert overlay.root["a"]["_w"] == [2.0]
+        assert self.base["a"]["_k"] == ["b", "e"]
+        assert self.base["a"]["_w"] == [1.0, 2.0]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+from toml_prompt.inner.cache import prompt_dict_cache
+from toml_prompt.inner.prompt import PromptFile
+from toml_prompt.inner.parser import PromptTagParser
+
+
+class TestParser(unittest.TestCase):
+    def setUp(self):
+        prompt_dict_cache.clear()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name: str, text: str) -> PromptFile:
+        path = os.path.join(self.root, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return PromptFile(path)
+
+    def test__nested(self):
+        prompt = self.write(
+            "main.toml",
+            "[a]\n_t = \"x, %b, <case><when key='a'>y</when><else>z</else></case>\"\n"
+            '[a.b]\n_t = "<neg>n</neg>, $::c"\n'
+            '[c]\n_t = "w"\n',
+        )
+        parser = PromptTagParser(prompt=prompt, seed=0)
+        parser.feed("a")
+        assert parser.positive == ["x, ", ", w", ", ", "y"]
+        assert parser.negative == ["n"]
+        assert list(parser.loaded_keys) == ["a", "a.b", "c"]
+
+    def test__deep(self):
+        def name(i: int) -> str:
+            return "k" + "".join(chr(ord("a") + int(c)) for c in str(i))
+
+        # 再帰呼び出しではPythonの再帰制限を超える深さ
+        n = 2000
+        text = "".join(f'[{name(i)}]\n_t = "%::{name(i + 1)}"\n' for i in range(n))
+        prompt = self.write("deep.toml", text + f'[{name(n)}]\n_t = "end"\n')
+        parser = PromptTagParser(prompt=prompt, seed=0, max_depth=n + 1)
+        parser.feed(name(0))
+        assert parser.positive == ["end"]
+
+        parser = PromptTagParser(prompt=prompt, seed=0, max_depth=100)
+        with self.assertRaises(RecursionError):
+            parser.feed(name(0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+from toml_prompt.inner.util import Random
+from toml_prompt.inner.plan import DecodePlan, PlanCache
+from toml_prompt.inner.tokenizer import expand_lora_tags, parse_events
+from toml_prompt.inner.prompt import remove_comment_out, select_dynamic_prompt
+
+
+class TestPlan(unittest.TestCase):
+    def test__same_as_regex(self):
+        s = "a, {b|<lora:x:0.5>|c} // d\n<when key='a'>e</when> /* f */ {g|h}"
+        plan = DecodePlan(s)
+        for seed in range(20):
+            r1 = Random(seed)
+            r2 = Random(seed)
+            expected = expand_lora_tags(
+                select_dynamic_prompt(r1, remove_comment_out(s))
+            )
+            assert plan.render(r2) == parse_events(expected)
+            assert r1.count == r2.count
+        assert len(plan.variants) == 6
+
+    def test__reuse(self):
+        plan = DecodePlan("a, <b>c</b>")
+        e1 = plan.render(Random(0))
+        e2 = plan.render(Random(1))
+        assert e1 is e2
+        # HTMLParserで解析した結果もキャッシュする
+        assert DecodePlan("a &amp; b").render(Random(0)) == [("data", "a & b")]
+
+    def test__cache(self):
+        cache = PlanCache(max_entries=2)
+        p = cache.get("a")
+        assert cache.get("a") is p
+        cache.get("b")
+        cache.get("c")
+        assert cache.get("a") is not p
+
+
+if __name__ == "__main__":
+    unittest.main()
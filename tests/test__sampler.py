@@ -0,0 +1,71 @@
+import unittest
+from toml_prompt.inner.util import Random
+from toml_prompt.inner.sampler import (
+    AliasSampler,
+    build_key_sampler,
+    build_inclusion_sampler,
+)
+
+KEYS = [(0, "a"), (1, "b"), (2, "c"), (3, "d")]
+
+
+class TestSampler(unittest.TestCase):
+    def test__cumulative(self):
+        weights = [0.5, "2", 0, 1.5]
+        sampler = build_key_sampler(KEYS, weights, "cumulative")
+        assert sampler is not None
+        for seed in range(20):
+            r1 = Random(seed)
+            r2 = Random(seed)
+            expected = [
+                r1.choices("abcd", [float(w) for w in weights])[0] for _ in range(10)
+            ]
+            assert [sampler.choose(r2) for _ in range(10)] == expected
+            assert r1.count == r2.count
+
+    def test__uniform(self):
+        sampler = build_key_sampler(KEYS, None, "alias")
+        assert sampler is not None
+        r1 = Random(0)
+        r2 = Random(0)
+        expected = [r1.choices("abcd")[0] for _ in range(10)]
+        assert [sampler.choose(r2) for _ in range(10)] == expected
+
+    def test__alias(self):
+        sampler = build_key_sampler(KEYS, [1, 0, 2, 1], "alias")
+        assert isinstance(sampler, AliasSampler)
+        rand = Random(0)
+        counts = {k: 0 for k in "abcd"}
+        for _ in range(40000):
+            counts[sampler.choose(rand)] += 1
+        assert rand.count == 40000
+        assert counts["b"] == 0
+        assert abs(counts["c"] / 40000 - 0.5) < 0.02
+        assert abs(counts["a"] / 40000 - 0.25) < 0.02
+
+    def test__invalid(self):
+        assert build_key_sampler([], None, "cumulative") is None
+        assert build_key_sampler(KEYS, [1, 1], "cumulative") is None
+        assert build_key_sampler(KEYS, [0, 0, 0, 0], "cumulative") is None
+        assert build_key_sampler(KEYS, [1, "x", 1, 1], "cumulative") is None
+
+    def test__inclusion(self):
+        weights = [0.3, 1.0, 0.0]
+        inclusion = build_inclusion_sampler(KEYS, weights)
+        assert inclusion is not None
+        for seed in range(20):
+            r1 = Random(seed)
+            r2 = Random(seed)
+            w = weights + [1.0]
+            expected = [
+                ik
+                for j, ik in enumerate(KEYS)
+                if r1.choices([True, False], [w[j], 1.0 - w[j]])[0]
+            ]
+            assert inclusion.choose(r2, KEYS) == expected
+            assert r1.count == r2.count
+        assert build_inclusion_sampler(KEYS, ["x"]) is None
+
+
+if __name__ == "__main__":
+    unittest.main()
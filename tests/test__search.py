@@ -7,6 +7,7 @@ from toml_prompt.inner.prompt import (
     get_keys_all_recursive,
     get_keys_random_recursive,
     build_search_keys,
+    iter_search_keys,
     collect_prompt,
 )
 
@@ -55,6 +56,33 @@ class TestSearch(unittest.TestCase):
         r = build_search_keys("a.b+d.c")
         assert r == ["a", "a.b", "a.b.c", "a.d", "a.d.c"]
 
+    def test__search_key_prune(self):
+        d: dict[str, Any] = {"a": {"b": {"c": "c"}, "r": {"_random_count": 1}}}
+        r = list(iter_search_keys("a.b+x.c+d", d))
+        assert r == ["a", "a.b", "a.b.c", "a.b.d", "a.x"]
+        r = list(iter_search_keys("a.r.x.c+d", d))
+        assert r == ["a", "a.r", "a.r.x", "a.r.x.c", "a.r.x.d"]
+        r = list(iter_search_keys("a.?.x.c", d))
+        assert r == ["a", "a.?", "a.?.x", "a.?.x.c"]
+        with self.assertRaises(Exception):
+            list(iter_search_keys("a+b+c.d+e+f", max_keys=8))
+
+    def test__search_shared_prefix(self):
+        d: dict[str, Any] = {
+            "t": {
+                "x": {
+                    "_exports": {"k": "x"},
+                    "y1": {"_exports": {"k": "y1"}, "_t": "y1"},
+                    "y2": "y2",
+                }
+            }
+        }
+        exports: dict[str, str] = {}
+        r = collect_prompt(self.random, d, "t.**", exports=exports)
+        assert r == ["y1", "y2"]
+        # 共通の接頭辞も辿るたびに処理する
+        assert exports == {"k": "x"}
+
     def test__search_key_random(self):
         r = build_search_keys("a.?.c")
         assert r == ["a", "a.?", "a.?.c"]
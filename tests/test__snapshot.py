@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+from toml_prompt.inner.cache import prompt_dict_cache
+from toml_prompt.inner.prompt import PromptFile
+from toml_prompt.inner.snapshot import snapshot_path, load_snapshot, main
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        prompt_dict_cache.clear()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "prompt.toml")
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write('[a]\n_t = "a"\n_w = [1.0, 0.5]\nb = "b"\n')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test__auto_compile(self):
+        prompt = PromptFile(self.path)
+        d = prompt.load_shared()
+        assert os.path.exists(snapshot_path(self.path))
+        r = load_snapshot(snapshot_path(self.path), self.path, prompt.cache_key[3])
+        assert r is not None and r[0] == d
+
+    def test__load_from_snapshot(self):
+        prompt = PromptFile(self.path)
+        assert prompt.compile()
+        prompt.text = "invalid toml ["
+        prompt_dict_cache.clear()
+        assert prompt.load_shared()["a"]["b"] == "b"
+
+    def test__stale_snapshot(self):
+        assert main([self.path]) == 0
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write('[a]\n_t = "changed"\n')
+        prompt_dict_cache.clear()
+        assert PromptFile(self.path).load_shared()["a"]["_t"] == "changed"
+
+    def test__validate(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write('[a]\n_k = "b"\n')
+        with self.assertRaises(Exception):
+            PromptFile(self.path).load_shared()
+
+
+if __name__ == "__main__":
+    unittest.main()
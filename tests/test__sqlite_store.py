@@ -0,0 +1,79 @@
+from typing import Any
+
+import os
+import sqlite3
+import tempfile
+import unittest
+from toml_prompt.inner.util import Random
+from toml_prompt.inner.cache import prompt_dict_cache
+from toml_prompt.inner.prompt import (
+    PromptFile,
+    build_search_keys,
+    collect_prompt,
+    get_keys_all_recursive,
+)
+from toml_prompt.inner.sqlite_store import SqliteDict, import_prompt_file
+
+
+class TestSqliteStore(unittest.TestCase):
+    def setUp(self):
+        prompt_dict_cache.clear()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmpdir.name, "prompt.toml")
+        self.db = os.path.join(self.tmpdir.name, "prompt.sqlite")
+        with open(self.src, "w", encoding="utf-8") as f:
+            f.write(
+                """
+[_exports]
+key = "value"
+[a]
+_t = "a"
+_k = ["c", "b"]
+_w = [1.0, 2.0]
+_post = ["::d"]
+b = "b"
+c = "c"
+[a.e]
+_when = "a.b"
+_t = "e"
+[d]
+_t = "d"
+[g]
+_t = "$v"
+v = ["v1", "v2"]
+"""
+            )
+        import_prompt_file(self.src, self.db)
+
+    def tearDown(self):
+        prompt_dict_cache.clear()
+        self.tmpdir.cleanup()
+
+    def test__roundtrip(self):
+        d = PromptFile(self.db).load_shared()
+        assert isinstance(d, SqliteDict)
+        src: dict[str, Any] = PromptFile(self.src).load()
+        assert d == src
+        assert list(d["a"].keys()) == list(src["a"].keys())
+        assert dict(d["_exports"].items()) == {"key": "value"}
+
+    def test__collect(self):
+        d = PromptFile(self.db).load_shared()
+        src = PromptFile(self.src).load_shared()
+        for key in ["a.b", "a.?", "a.c", "a.e", "d.**", "g"]:
+            r1 = collect_prompt(Random(seed=1), d, build_search_keys(key))
+            r2 = collect_prompt(Random(seed=1), src, build_search_keys(key))
+            assert r1 == r2, key
+        assert get_keys_all_recursive(d["d"]) == get_keys_all_recursive(src["d"])
+
+    def test__schema_version(self):
+        conn = sqlite3.connect(self.db)
+        conn.execute("UPDATE info SET value = '999' WHERE key = 'schema_version'")
+        conn.commit()
+        conn.close()
+        with self.assertRaisesRegex(Exception, "schema_version=999"):
+            PromptFile(self.db).load_library()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import random
+import unittest
+from toml_prompt.inner.util import Random
+from toml_prompt.inner.template import compile_template, TemplateCache
+from toml_prompt.inner.prompt import (
+    expand_prompt_var,
+    remove_comment_out,
+    select_dynamic_prompt,
+)
+
+
+class TestTemplate(unittest.TestCase):
+    def test__tokens(self):
+        t = compile_template("a, $b {c|%::d.e} // f", ["x"])
+        assert t.tokens == [
+            ("text", "a, "),
+            ("var", "x.b"),
+            ("text", " "),
+            ("choice", ["c", "<tag>d.e</tag>"]),
+            ("text", " "),
+        ]
+        assert t.text is None
+        t = compile_template("a, $b", ["x"])
+        assert t.text == "a, <var>x.b</var>"
+
+    def test__same_as_regex(self):
+        g = random.Random(0)
+        alphabet = ["a", "b", " ", "$", "%", "::", ".", "{", "}", "|", "/", "*"]
+        alphabet += ["#", "\n", "?", "<var>", "</var>", "_"]
+        for _ in range(2000):
+            value = "".join(g.choice(alphabet) for _ in range(g.randint(0, 30)))
+            prefix = g.choice([[], ["x"], ["x", "y"]])
+            for seed in range(3):
+                r1 = Random(seed)
+                r2 = Random(seed)
+                expected = select_dynamic_prompt(
+                    r1, remove_comment_out(expand_prompt_var(r1, value, prefix))
+                )
+                assert compile_template(value, prefix).render(r2) == expected
+                assert r1.count == r2.count
+
+    def test__cache(self):
+        cache = TemplateCache()
+        t = cache.get("$a", ["x"])
+        assert cache.get("$a", ["x"]) is t
+        assert cache.get("$a", ["y"]) is not t
+
+
+if __name__ == "__main__":
+    unittest.main()
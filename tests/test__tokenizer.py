@@ -0,0 +1,95 @@
+import unittest
+from html.parser import HTMLParser
+from toml_prompt.inner.tokenizer import (
+    Node,
+    Element,
+    EndTag,
+    Pi,
+    parse_key_list,
+    dump_nodes,
+)
+
+
+class Recorder(HTMLParser):
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.events: list[tuple[str, ...]] = []
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]):
+        self.events += [("start", tag, str(attrs))]
+
+    def handle_endtag(self, tag: str):
+        self.events += [("end", tag)]
+
+    def handle_data(self, data: str):
+        self.events += [("data", data)]
+
+    def handle_pi(self, data: str):
+        self.events += [("pi", data)]
+
+
+def to_events(nodes: list[Node], events: list[tuple[str, ...]]):
+    for node in nodes:
+        if isinstance(node, Element):
+            events += [("start", node.name, str(node.attrs))]
+            to_events(node.children, events)
+            if node.closed:
+                events += [("end", node.name)]
+        elif isinstance(node, EndTag):
+            events += [("end", node.name)]
+        elif isinstance(node, Pi):
+            events += [("pi", node.data)]
+        else:
+            events += [("data", node.data)]
+    return events
+
+
+class TestTokenizer(unittest.TestCase):
+    def test__parse(self):
+        data = "a, <case><when key=b>c</when><else/></case><?set x 'y z'>d"
+        nodes = parse_key_list(data)
+        assert nodes is not None
+        assert dump_nodes(nodes) == [
+            "a, ",
+            (
+                "case",
+                [],
+                [("when", [("key", "b")], ["c"], True), ("else", [], [], True)],
+                True,
+            ),
+            ("?", "set x 'y z'"),
+            "d",
+        ]
+        case = nodes[1]
+        assert isinstance(case, Element)
+        assert case.pos == 3
+        assert case.children[0].pos == 9
+
+    def test__attrs(self):
+        nodes = parse_key_list("<random A=0.1 b='0.9' c>")
+        assert nodes is not None
+        assert dump_nodes(nodes) == [
+            ("random", [("a", "0.1"), ("b", "0.9"), ("c", None)], [], False)
+        ]
+
+    def test__stray_end(self):
+        nodes = parse_key_list("<raw>a</neg></raw>")
+        assert nodes is not None
+        assert dump_nodes(nodes) == [("raw", [], ["a", ("/neg",)], True)]
+
+    def test__fallback(self):
+        for data in ["a &amp; b", "a < b", "<!-- c -->", "<when key=a/>", "<raw"]:
+            assert parse_key_list(data) is None, data
+
+    def test__same_as_html_parser(self):
+        data = "a\n<raw>b, c</raw>\n<RANDOM a=1 b=2><when key=a>x</when></random><?e>"
+        r = Recorder()
+        r.feed(data)
+        nodes = parse_key_list(data)
+        assert nodes is not None
+        events = to_events(nodes, [])
+        assert events == r.events
+
+
+if __name__ == "__main__":
+    unittest.main()
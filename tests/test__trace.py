@@ -0,0 +1,80 @@
+import io
+import os
+import json
+import tempfile
+import unittest
+import contextlib
+from toml_prompt.inner.cache import prompt_dict_cache
+from toml_prompt.inner.prompt import PromptFile
+from toml_prompt.inner.parser import PromptTagParser
+from toml_prompt.inner.trace import Tracer, tracer
+
+
+class TestTrace(unittest.TestCase):
+    def setUp(self):
+        prompt_dict_cache.clear()
+        tracer.clear()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmpdir.name, "main.toml")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write('[a]\n_t = "x"\n[b]\n_t = "<?export k v>y"\n')
+        self.prompt = PromptFile(path)
+
+    def tearDown(self):
+        tracer.configure(enabled=False, echo=False)
+        tracer.clear()
+        self.tmpdir.cleanup()
+
+    def test__ring_buffer(self):
+        t = Tracer(capacity=3, enabled=True)
+        for i in range(5):
+            t.emit("e", i=i)
+        assert [e[3]["i"] for e in t.get()] == [2, 3, 4]
+        t.configure(capacity=2)
+        assert [e[3]["i"] for e in t.get()] == [3, 4]
+
+    def test__jsonl(self):
+        t = Tracer(enabled=True)
+        with t.scope(7):
+            t.emit("set", key="a", value=["b"])
+        t.emit("else")
+        lines = t.to_jsonl().splitlines()
+        assert json.loads(lines[0]) == {
+            "seq": 1,
+            "decode": 7,
+            "kind": "set",
+            "key": "a",
+            "value": ["b"],
+        }
+        assert json.loads(lines[1])["decode"] == 0
+        f = io.StringIO()
+        t.dump_jsonl(f, decode_id=7)
+        assert f.getvalue() == lines[0] + "\n"
+
+    def test__decode(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            parser = PromptTagParser(prompt=self.prompt, seed=0)
+            parser.feed("a, b")
+        assert tracer.get() == [] and out.getvalue() == ""
+
+        tracer.configure(enabled=True)
+        p1 = PromptTagParser(prompt=self.prompt, seed=0)
+        p2 = PromptTagParser(prompt=self.prompt, seed=0)
+        p1.feed("a")
+        p2.feed("b")
+        assert [(e[2], e[3]) for e in tracer.get(p1.decode_id)] == [
+            ("load", {"key": "a", "duplicated": False})
+        ]
+        assert [e[2] for e in tracer.get(p2.decode_id)] == ["load", "export"]
+
+    def test__echo(self):
+        tracer.configure(enabled=True, echo=True)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            PromptTagParser(prompt=self.prompt, seed=0).feed("a")
+        assert out.getvalue() == "load: key=a duplicated=False\n"
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import random
+import tempfile
+import unittest
+from toml_prompt.inner.cache import prompt_dict_cache
+from toml_prompt.inner.prompt import PromptFile
+from toml_prompt.inner.util import CounterRandom, Random, new_random
+from toml_prompt.toml_prompt_decode import decode_prompt
+
+
+class TestRandom(unittest.TestCase):
+    def test__mt(self):
+        # set_countで読み飛ばしても random.Random と同じ乱数列
+        r = Random(7)
+        r.random()
+        r.set_count(100)
+        r.choices(["a", "b"])
+        r.set_count(3)
+        expected = random.Random(7)
+        for _ in range(103):
+            expected.random()
+        assert r.random() == expected.random()
+        assert r.count == 1
+
+    def test__splitmix(self):
+        assert CounterRandom(0).random() == (0xE220A8397B1DCDAF >> 11) * 2.0**-53
+        a = CounterRandom(5)
+        a.random()
+        a.set_count(1000000)
+        a.random()
+        a.set_count(2)
+        b = CounterRandom(5)
+        for _ in range(1000002):
+            b.random()
+        assert a.random() == b.random()
+        assert a.count == 1 and isinstance(new_random(1, "splitmix"), CounterRandom)
+        with self.assertRaises(AssertionError):
+            a.set_count(0)
+
+    def test__splitmix_seed(self):
+        # random.Randomと同じ型のシードを受け付け、同じ値なら同じ乱数列
+        for seed in ["abc", b"abc", bytearray(b"abc"), 1.5]:
+            assert CounterRandom(seed).random() == CounterRandom(seed).random()
+        assert CounterRandom("abc").random() != CounterRandom("abd").random()
+        assert CounterRandom("abc").random() == CounterRandom(b"abc").random()
+
+    def test__library(self):
+        prompt_dict_cache.clear()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            body = '[a]\n_t = "{p|q|r|s|t}, {p|q|r|s|t}"\n_random_count = 50\n'
+            results: dict[str, list[str]] = {}
+            for rng in ["", '_rng = "mt"\n', '_rng = "splitmix"\n']:
+                path = os.path.join(tmpdir, f"{len(results)}.toml")
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(rng + body)
+                prompt = PromptFile(path)
+                results[rng] = [decode_prompt(s, prompt, "a")[0] for s in range(20)]
+            assert results[""] == results['_rng = "mt"\n']
+            assert results[""] != results['_rng = "splitmix"\n']
+
+            path = os.path.join(tmpdir, "bad.toml")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write('_rng = "xorshift"\n' + body)
+            with self.assertRaises(Exception):
+                PromptFile(path).load_library()
+
+
+if __name__ == "__main__":
+    unittest.main()
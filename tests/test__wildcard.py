@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+from toml_prompt.inner.util import Random
+from toml_prompt.inner.wildcard import WildcardFile, INDEX_EXT
+
+
+class TestWildcard(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "wild.txt")
+        self.lines = ["# comment", " a ", "// comment", "", "b", "　c"]
+        with open(self.path, "w", encoding="utf-8", newline="\r\n") as f:
+            f.write("\n".join(self.lines) + "\n")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def expected(self):
+        r: list[str] = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f.readlines():
+                line = line.strip()
+                if not line.startswith("#") and not line.startswith("//"):
+                    r += [line]
+        return r
+
+    def test__lines(self):
+        w = WildcardFile(self.path)
+        assert list(w) == self.expected()
+        assert [w[i] for i in range(len(w))] == self.expected()
+        assert w[-1] == "c"
+        assert w[1:3] == ["", "b"]
+
+    def test__persist_index(self):
+        WildcardFile(self.path)
+        assert os.path.exists(self.path + INDEX_EXT)
+        assert list(WildcardFile(self.path)) == self.expected()
+
+    def test__random_compatible(self):
+        w = WildcardFile(self.path)
+        r1 = [Random(seed=i).choices(w)[0] for i in range(20)]
+        r2 = [Random(seed=i).choices(self.expected())[0] for i in range(20)]
+        assert r1 == r2
+
+
+if __name__ == "__main__":
+    unittest.main()
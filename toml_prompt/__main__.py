@@ -0,0 +1,6 @@
+import sys
+
+from .bulk_decode import main
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+from typing import Any, BinaryIO, Iterator, cast
+
+import io
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from .inner.prompt import PromptFile
+from .toml_prompt_decode import SEED_MAX, batch_seeds, decode_prompt
+
+# PromptDecode.RETURN_TYPES と同じ順序
+FIELDS = ("positive", "negative", "lora_list", "seed", "summary", "exports")
+FORMATS = ("jsonl", "csv")
+
+type Row = tuple[str, str, str, int, str, str]
+
+
+# 再開できないチェックポイント
+class CheckpointError(Exception):
+    pass
+
+
+# ワーカープロセスごとにライブラリを1回だけ読み込む
+worker_state: dict[str, Any] = {}
+
+
+def init_worker(path: str, key_name_list: str, dedupe_tags: bool):
+    prompt = PromptFile(path)
+    worker_state.update(
+        prompt=prompt,
+        library=prompt.load_library(),
+        key_name_list=key_name_list,
+        dedupe_tags=dedupe_tags,
+    )
+
+
+def decode_seeds(seeds: list[int]) -> list[Row]:
+    s = worker_state
+    return [
+        decode_prompt(
+            seed, s["prompt"], s["key_name_list"], s["dedupe_tags"], s["library"]
+        )
+        for seed in seeds
+    ]
+
+
+def chunk_seeds(
+    seed: int, count: int, stride: int, begin: int, chunk_size: int
+) -> Iterator[list[int]]:
+    for i in range(begin, count, chunk_size):
+        n = min(chunk_size, count - i)
+        yield batch_seeds((seed + i * stride) & SEED_MAX, n, stride)
+
+
+def run_chunks(
+    path: str,
+    key_name_list: str,
+    dedupe_tags: bool,
+    chunks: Iterator[list[int]],
+    workers: int,
+) -> Iterator[list[Row]]:
+    initargs = (path, key_name_list, dedupe_tags)
+    if workers <= 1:
+        init_worker(*initargs)
+        for seeds in chunks:
+            yield decode_seeds(seeds)
+        return
+
+    # 先行して投入するチャンク数を制限し、完了順ではなく投入順に返す
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=initargs) as ex:
+        pending: deque[Future[list[Row]]] = deque()
+        for seeds in chunks:
+            pending.append(ex.submit(decode_seeds, seeds))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def format_rows(rows: list[Row], fmt: str) -> str:
+    if fmt == "csv":
+        buf = io.StringIO()
+        csv.writer(buf, lineterminator="\n").writerows(rows)
+        return buf.getvalue()
+    return "".join(
+        [json.dumps(dict(zip(FIELDS, r)), ensure_ascii=False) + "\n" for r in rows]
+    )
+
+
+def format_header(fmt: str) -> str:
+    return format_rows([cast(Row, FIELDS)], fmt) if fmt == "csv" else ""
+
+
+def job_spec(args: argparse.Namespace, prompt: PromptFile, key_name_list: str):
+    # 再開時に同じジョブかを判定する
+    _, size, mtime, sha256 = prompt.cache_key
+    return {
+        "prompt": os.path.realpath(args.prompt),
+        "source": sha256 or [size, mtime],
+        "key_name_list": key_name_list,
+        "seed": args.seed,
+        "count": args.count,
+        "stride": args.stride,
+        "format": args.format,
+        "dedupe_tags": args.dedupe_tags,
+    }
+
+
+def load_checkpoint(path: str) -> dict[str, Any] | None:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path: str, spec: dict[str, Any], done: int, offset: int):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"job": spec, "done": done, "offset": offset}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def report_progress(done: int, count: int, start_done: int, started: float):
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    rate = (done - start_done) / elapsed
+    sys.stderr.write(f"\r{done}/{count} seeds ({rate:.1f}/s)")
+    sys.stderr.flush()
+
+
+def bulk_decode(args: argparse.Namespace) -> int:
+    if args.keys_file is not None:
+        with open(args.keys_file, "r", encoding="utf-8") as f:
+            key_name_list = f.read()
+    else:
+        key_name_list = cast(str, args.keys)
+    prompt = PromptFile(args.prompt)
+    spec = job_spec(args, prompt, key_name_list)
+
+    done = 0
+    offset = 0
+    if args.checkpoint is not None:
+        state = load_checkpoint(args.checkpoint)
+        if state is not None:
+            if state["job"] != spec:
+                raise CheckpointError(
+                    f"Checkpoint is for another job: {args.checkpoint}"
+                )
+            done = cast(int, state["done"])
+            offset = cast(int, state["offset"])
+            # 記録より短い出力を伸ばすと壊れたまま続きを書くことになる
+            try:
+                size = os.path.getsize(args.output)
+            except OSError:
+                raise CheckpointError(f"Output file is missing: {args.output}")
+            if size < offset:
+                raise CheckpointError(
+                    f"Output file is shorter than the checkpoint: {args.output}"
+                )
+
+    out: BinaryIO
+    if args.output is None:
+        out = sys.stdout.buffer
+    else:
+        # 再開時は最後に記録した位置以降の書きかけを捨てる
+        out = open(args.output, "r+b" if offset else "wb")
+        out.truncate(offset)
+        out.seek(offset)
+    try:
+        if done == 0:
+            data = format_header(args.format).encode("utf-8")
+            out.write(data)
+            offset += len(data)
+
+        start_done = done
+        started = time.perf_counter()
+        chunks = chunk_seeds(args.seed, args.count, args.stride, done, args.chunk_size)
+        for rows in run_chunks(
+            args.prompt, key_name_list, args.dedupe_tags, chunks, args.workers
+        ):
+            data = format_rows(rows, args.format).encode("utf-8")
+            out.write(data)
+            out.flush()
+            done += len(rows)
+            offset += len(data)
+            if args.checkpoint is not None:
+                save_checkpoint(args.checkpoint, spec, done, offset)
+            if args.progress:
+                report_progress(done, args.count, start_done, started)
+        if args.progress:
+            sys.stderr.write("\n")
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    return done
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m toml_prompt",
+        description="Decode a key_name_list for a range of seeds like PromptDecode.",
+    )
+    parser.add_argument("prompt", help="TOML/YAML/SQLite prompt file.")
+    keys = parser.add_mutually_exclusive_group(required=True)
+    keys.add_argument("-k", "--keys", help="key_name_list.")
+    keys.add_argument("-K", "--keys-file", help="File containing key_name_list.")
+    parser.add_argument("--seed", type=int, default=0, help="First seed.")
+    parser.add_argument("-n", "--count", type=int, default=1, help="Number of seeds.")
+    parser.add_argument("--stride", type=int, default=1, help="Seed increment.")
+    parser.add_argument("--dedupe-tags", action="store_true")
+    parser.add_argument("-f", "--format", choices=FORMATS, default="jsonl")
+    parser.add_argument("-o", "--output", help="Output file. (default: stdout)")
+    parser.add_argument(
+        "-j", "--workers", type=int, default=os.cpu_count() or 1, help="Processes."
+    )
+    parser.add_argument("--chunk-size", type=int, default=64, help="Seeds per task.")
+    parser.add_argument(
+        "--checkpoint", help="Progress file to resume an interrupted run."
+    )
+    parser.add_argument("--progress", action="store_true", help="Report to stderr.")
+    args = parser.parse_args(argv)
+    if not 0 <= args.seed <= SEED_MAX:
+        parser.error("--seed is out of range")
+    if args.count < 0 or args.stride < 1 or args.chunk_size < 1:
+        parser.error("--count, --stride and --chunk-size must be positive")
+    if args.checkpoint is not None and args.output is None:
+        parser.error("--checkpoint requires --output")
+    try:
+        bulk_decode(args)
+    except CheckpointError as e:
+        parser.error(str(e))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
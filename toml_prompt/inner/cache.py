@@ -0,0 +1,87 @@
+from typing import Any, Callable
+from collections import OrderedDict
+
+import threading
+
+type CacheKey = tuple[str, int, int, str]
+
+
+class LRUCache:
+    def __init__(self, max_bytes: int, max_entries: int | None = None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries: OrderedDict[Any, tuple[Any, int]] = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.entries
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key: Any, value: Any, size: int):
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            # 予算を超える単一エントリはキャッシュしない
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (value, size)
+            self.total_bytes += size
+            self.evict()
+
+    def get_or_create(self, key: Any, create: Callable[[], tuple[Any, int]]) -> Any:
+        with self.lock:
+            if key in self.entries:
+                return self.get(key)
+            self.misses += 1
+            value, size = create()
+            self.put(key, value, size)
+            return value
+
+    def remove(self, key: Any):
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+
+    def remove_if(self, pred: Callable[[Any], bool]):
+        with self.lock:
+            for key in [k for k in self.entries.keys() if pred(k)]:
+                self.remove(key)
+
+    def evict(self):
+        while self.entries and (
+            self.total_bytes > self.max_bytes
+            or (self.max_entries is not None and len(self.entries) > self.max_entries)
+        ):
+            _, (_, size) = self.entries.popitem(last=False)
+            self.total_bytes -= size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+# 解析済みプロンプト辞書のプロセス共有キャッシュ
+prompt_dict_cache = LRUCache(max_bytes=256 * 1024 * 1024)
+
+# _load_from_fileで読み込んだ行リストのキャッシュ
+wildcard_cache = LRUCache(max_bytes=256 * 1024 * 1024)
+
+# <?grep>の絞り込み結果のキャッシュ (値のid, 条件) -> (値, 結果)
+grep_cache = LRUCache(max_bytes=64 * 1024 * 1024)
@@ -0,0 +1,99 @@
+from typing import Any, cast
+
+import os
+import json
+import threading
+
+type DirEntry = tuple[int, list[str], list[str]]
+
+
+class DirectoryIndex:
+    def __init__(
+        self,
+        root: str,
+        extensions: tuple[str, ...],
+        index_path: str | None = None,
+    ):
+        self.root = root
+        self.extensions = extensions
+        self.index_path = index_path
+        # ディレクトリの相対パス -> (mtime_ns, サブディレクトリ, ファイル)
+        self.dirs: dict[str, DirEntry] = {}
+        self.files: list[str] = []
+        self.lock = threading.Lock()
+        if index_path is not None:
+            self.load_index()
+
+    def load_index(self):
+        try:
+            with open(cast(str, self.index_path), "r", encoding="utf-8") as f:
+                data = cast(dict[str, Any], json.load(f))
+        except (OSError, ValueError):
+            return
+        if data.get("extensions") != list(self.extensions):
+            return
+        self.dirs = {k: (v[0], v[1], v[2]) for k, v in data["dirs"].items()}
+
+    def save_index(self):
+        if self.index_path is None:
+            return
+        tmp_path = f"{self.index_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"extensions": list(self.extensions), "dirs": self.dirs}, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            pass
+
+    def scan_dir(self, rel: str, mtime_ns: int) -> DirEntry:
+        subdirs: list[str] = []
+        files: list[str] = []
+        with os.scandir(os.path.join(self.root, rel)) as it:
+            for e in it:
+                if e.is_dir():
+                    # os.walkと同じくシンボリックリンク先のディレクトリは辿らない
+                    if not e.is_symlink():
+                        subdirs += [e.name]
+                elif e.name.endswith(self.extensions):
+                    files += [e.name]
+        return (mtime_ns, sorted(subdirs), sorted(files))
+
+    def refresh(self) -> list[str]:
+        with self.lock:
+            dirs: dict[str, DirEntry] = {}
+            files: list[str] = []
+            changed = False
+            stack = [""]
+            while stack:
+                rel = stack.pop()
+                try:
+                    mtime_ns = os.stat(os.path.join(self.root, rel)).st_mtime_ns
+                except OSError:
+                    changed = True
+                    continue
+                entry = self.dirs.get(rel, None)
+                # mtimeが変わったディレクトリだけ再スキャン
+                if entry is None or entry[0] != mtime_ns:
+                    try:
+                        entry = self.scan_dir(rel, mtime_ns)
+                    except OSError:
+                        changed = True
+                        continue
+                    changed = True
+                dirs[rel] = entry
+                files += [f"{rel}/{f}" if rel else f for f in entry[2]]
+                stack += [f"{rel}/{d}" if rel else d for d in reversed(entry[1])]
+            if changed or len(dirs) != len(self.dirs):
+                self.dirs = dirs
+                self.save_index()
+            self.files = sorted(files)
+            return self.files
+
+    def resolve(self, name: str) -> str:
+        # 以前のファイル名のみの指定にも対応
+        if os.path.exists(os.path.join(self.root, name)) or "/" in name:
+            return name
+        if not self.files:
+            self.refresh()
+        candidates = [f for f in self.files if f.split("/")[-1] == name]
+        return candidates[0] if len(candidates) == 1 else name
@@ -0,0 +1,129 @@
+from typing import Any, cast
+
+import os
+import hashlib
+import threading
+
+from .prompt import PromptFile, PromptDict, register_index
+from .mount import MOUNT_KEY, PROMPT_EXTS, MountedDict, is_mount
+
+type StatKey = tuple[int, int]
+
+
+def stat_key(path: str) -> StatKey | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+
+@register_index("dependencies")
+def collect_dependencies(d: PromptDict) -> list[tuple[str, bool]]:
+    # (相対パス, プロンプトファイルか)
+    r: list[tuple[str, bool]] = []
+    stack: list[Any] = [d]
+    while stack:
+        v = stack.pop()
+        if is_mount(v):
+            spec = v.spec if isinstance(v, MountedDict) else v
+            r += [(cast(str, spec[MOUNT_KEY]), True)]
+        elif isinstance(v, dict):
+            v = cast(PromptDict, v)
+            if isinstance(v.get("_load_from_file", None), str):
+                r += [(cast(str, v["_load_from_file"]), False)]
+            stack += reversed(list(v.values()))
+        elif isinstance(v, list):
+            stack += reversed(cast(list[Any], v))
+    return list(dict.fromkeys(r))
+
+
+def list_prompt_files(path: str) -> list[str]:
+    r: list[str] = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        r += [os.path.join(root, f) for f in sorted(files) if f.endswith(PROMPT_EXTS)]
+    return r
+
+
+class FingerprintService:
+    def __init__(self):
+        self.digests: dict[str, tuple[StatKey, str]] = {}
+        self.dependencies: dict[str, tuple[StatKey, list[tuple[str, bool]]]] = {}
+        self.lock = threading.Lock()
+
+    def digest(self, path: str) -> str:
+        path = os.path.realpath(path)
+        key = stat_key(path)
+        if key is None:
+            return "missing"
+        with self.lock:
+            cached = self.digests.get(path, None)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+        m = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                m.update(chunk)
+        digest = m.hexdigest()
+        with self.lock:
+            self.digests[path] = (key, digest)
+        return digest
+
+    def get_dependencies(self, path: str) -> list[tuple[str, bool]]:
+        path = os.path.realpath(path)
+        key = stat_key(path)
+        if key is None:
+            return []
+        with self.lock:
+            cached = self.dependencies.get(path, None)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+        try:
+            prompt = PromptFile(path)
+            if prompt.cache_key[3]:
+                # 読み込んだ内容のハッシュを使い、同じファイルを二度読まない
+                with self.lock:
+                    self.digests[path] = (key, prompt.cache_key[3])
+            library = prompt.load_library()
+            deps = [
+                (os.path.join(os.path.dirname(path), dep), is_prompt)
+                for dep, is_prompt in cast(
+                    list[tuple[str, bool]], library.get_index("dependencies")
+                )
+            ]
+        except Exception:
+            # 構文エラーなどはload_promptで報告させ、ここではファイル本体だけを対象にする
+            deps = []
+        with self.lock:
+            self.dependencies[path] = (key, deps)
+        return deps
+
+    def fingerprint(self, path: str) -> str:
+        # プロンプトファイル本体と_include, _load_from_fileで参照される全ファイルを対象とする
+        m = hashlib.sha256()
+        seen: set[str] = set()
+        stack: list[tuple[str, bool]] = [(path, True)]
+        while stack:
+            p, is_prompt = stack.pop()
+            p = os.path.realpath(p)
+            if p in seen:
+                continue
+            seen.add(p)
+            if is_prompt and os.path.isdir(p):
+                m.update(f"{p}\0dir\0".encode("utf-8"))
+                stack += [(f, True) for f in reversed(list_prompt_files(p))]
+                continue
+            # 依存関係の解析で読んだ内容のハッシュがdigestに使われる
+            deps = self.get_dependencies(p) if is_prompt else []
+            m.update(f"{p}\0{self.digest(p)}\0".encode("utf-8"))
+            stack += list(reversed(deps))
+        return m.hexdigest()
+
+    def clear(self):
+        with self.lock:
+            self.digests.clear()
+            self.dependencies.clear()
+
+
+fingerprints = FingerprintService()
@@ -0,0 +1,87 @@
+from typing import Any, Sequence, cast
+
+import re
+import itertools
+import functools
+
+from .cache import grep_cache
+from .wildcard import WildcardFile
+
+GREP_REGEX = re.compile(r"/(.*)/([ims]*)", flags=re.DOTALL)
+
+type GrepTerms = tuple[str, ...]
+
+
+class GrepTermError(ValueError):
+    def __init__(self, term: str, error: re.error):
+        super().__init__(f"Invalid grep term: {term} ({error})")
+        self.term = term
+        self.error = error
+
+
+# <?grep>の条件 全ての条件に一致する値を選ぶ
+# 'abc': 部分文字列 '/a.c/i': 正規表現 '!abc': 一致しないもの
+class GrepFilter:
+    def __init__(self, terms: GrepTerms):
+        self.terms: list[tuple[str | re.Pattern[str], bool]] = []
+        for term in terms:
+            original = term
+            negate = len(term) > 1 and term.startswith("!")
+            if negate:
+                term = term[1:]
+            m = GREP_REGEX.fullmatch(term)
+            if m is None:
+                self.terms += [(term, negate)]
+            else:
+                flags = 0
+                for c in m.group(2):
+                    flags |= {"i": re.I, "m": re.M, "s": re.S}[c]
+                try:
+                    pattern = re.compile(m.group(1), flags)
+                except re.error as e:
+                    raise GrepTermError(original, e) from e
+                self.terms += [(pattern, negate)]
+
+    def filter(self, values: list[str]) -> list[str]:
+        # 条件ごとに全体をまとめて絞り込む 後の条件ほど対象が少ない
+        for term, negate in self.terms:
+            if isinstance(term, str):
+                if negate:
+                    values = [v for v in values if term not in v]
+                else:
+                    values = [v for v in values if term in v]
+            elif negate:
+                values = list(itertools.filterfalse(term.search, values))
+            else:
+                values = list(filter(term.search, values))
+        return values
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_grep(terms: GrepTerms) -> GrepFilter:
+    return GrepFilter(terms)
+
+
+def grep_lines(values: Sequence[Any], terms: GrepTerms) -> list[str]:
+    if isinstance(values, WildcardFile):
+        lines = values.read_all()
+    else:
+        lines = [v if isinstance(v, str) else str(v) for v in values]
+    return compile_grep(terms).filter(lines)
+
+
+def grep_values(values: Sequence[Any], terms: GrepTerms, shared: bool) -> list[str]:
+    # 共有された値(ライブラリのリストや_load_from_fileの行)は結果をキャッシュする
+    if not shared:
+        return grep_lines(values, terms)
+
+    def create() -> tuple[tuple[Sequence[Any], list[str]], int]:
+        r = grep_lines(values, terms)
+        # 値を保持してidの再利用を防ぐ
+        return (values, r), sum(map(len, r)) + 64 * len(r)
+
+    cached = cast(
+        tuple[Sequence[Any], list[str]],
+        grep_cache.get_or_create((id(values), terms), create),
+    )
+    return list(cached[1])
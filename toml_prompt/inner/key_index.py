@@ -0,0 +1,34 @@
+NGRAM = 3
+
+
+# ドット区切りのキーパスに対するtrigram索引
+# 部分文字列検索は最も短いポスティングリストの候補だけを照合する
+class KeyPathIndex:
+    def __init__(self, paths: list[str]):
+        self.paths = paths
+        self.postings: dict[str, list[int]] = {}
+        for i, path in enumerate(paths):
+            for gram in set(path[j : j + NGRAM] for j in range(len(path) - NGRAM + 1)):
+                self.postings.setdefault(gram, []).append(i)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def candidates(self, sub: str) -> list[int] | None:
+        if len(sub) < NGRAM:
+            return None
+        r: list[int] | None = None
+        for j in range(len(sub) - NGRAM + 1):
+            posting = self.postings.get(sub[j : j + NGRAM], [])
+            if r is None or len(posting) < len(r):
+                r = posting
+            if not r:
+                break
+        return r
+
+    def find(self, sub: str) -> list[str]:
+        # 元の順序を保つ
+        candidates = self.candidates(sub)
+        if candidates is None:
+            return [path for path in self.paths if sub in path]
+        return [self.paths[i] for i in candidates if sub in self.paths[i]]
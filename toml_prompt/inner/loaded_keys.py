@@ -0,0 +1,73 @@
+from typing import Any, Iterable, Iterator
+
+import threading
+
+
+# ドット区切りのキーパス -> 整数ID
+class KeyInterner:
+    def __init__(self):
+        self.ids: dict[str, int] = {}
+        self.keys: list[str] = []
+        self.lock = threading.Lock()
+
+    def lookup(self, key: Any) -> int | None:
+        return self.ids.get(key, None) if isinstance(key, str) else None
+
+    def intern(self, key: str) -> int:
+        i = self.ids.get(key, None)
+        if i is None:
+            with self.lock:
+                i = self.ids.get(key, None)
+                if i is None:
+                    i = len(self.keys)
+                    self.keys += [key]
+                    self.ids[key] = i
+        return i
+
+
+# 読み込み済みキーの挿入順を保つ集合
+# listと同じく += で追加でき、inはO(1)
+class LoadedKeys:
+    def __init__(self, keys: Iterable[str] = (), interner: KeyInterner | None = None):
+        # 通常はライブラリのものを共有し、ライブラリと一緒に解放される
+        self.interner = KeyInterner() if interner is None else interner
+        self.ids: dict[int, None] = {}
+        self.extend(keys)
+
+    def add(self, key: str):
+        self.ids[self.interner.intern(key)] = None
+
+    def append(self, key: str):
+        self.add(key)
+
+    def extend(self, keys: Iterable[str]):
+        for key in keys:
+            self.add(key)
+
+    def __iadd__(self, keys: Iterable[str]):
+        self.extend(keys)
+        return self
+
+    def __contains__(self, key: object) -> bool:
+        i = self.interner.lookup(key)
+        return i is not None and i in self.ids
+
+    def __iter__(self) -> Iterator[str]:
+        keys = self.interner.keys
+        return (keys[i] for i in list(self.ids))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, LoadedKeys):
+            return list(self) == list(other)
+        return list(self) == other
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        return f"LoadedKeys({list(self)!r})"
+
+
+type KeyList = list[str] | LoadedKeys
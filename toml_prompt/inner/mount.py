@@ -0,0 +1,168 @@
+from typing import Any, Iterator, TYPE_CHECKING, cast
+
+import os
+import copy
+import threading
+
+if TYPE_CHECKING:
+    from _collections_abc import dict_items, dict_keys, dict_values
+    from .prompt import PromptLibrary
+
+MOUNT_KEY = "_include"
+PROMPT_EXTS = (".toml", ".txt", ".yaml", ".yml")
+
+# MountedDictを読み込まずに中身を参照するための未束縛メソッド
+RawDict = dict[str, Any]
+
+
+# _includeで指定された別ファイル・ディレクトリを最初にアクセスされた時に読み込む
+class MountedDict(dict[str, Any]):
+    def __init__(self, spec: dict[str, Any], root_dir: str):
+        super().__init__(spec)
+        self.spec = spec
+        self.root_dir = root_dir
+        self.loaded = False
+        self.lock = threading.Lock()
+        self.stat: tuple[int, int] | None = None
+        self.children: list[MountedDict] = []
+
+    @property
+    def mount_path(self) -> str:
+        return os.path.join(self.root_dir, cast(str, self.spec[MOUNT_KEY]))
+
+    def load(self):
+        if self.loaded:
+            return
+        with self.lock:
+            if self.loaded:
+                return
+            path = self.mount_path
+            st = os.stat(path)
+            self.stat = (st.st_size, st.st_mtime_ns)
+            if os.path.isdir(path):
+                content = load_directory(path)
+                self.children = [
+                    v for v in content.values() if isinstance(v, MountedDict)
+                ]
+            else:
+                library = load_file(path)
+                content = library.prompt_dict
+                self.children = library.mounted
+            super().clear()
+            super().update(content)
+            # _include以外のキーはマウント先より優先
+            super().update(self.spec)
+            self.loaded = True
+
+    def is_stale(self) -> bool:
+        if not self.loaded:
+            return False
+        try:
+            st = os.stat(self.mount_path)
+        except OSError:
+            return True
+        if self.stat != (st.st_size, st.st_mtime_ns):
+            return True
+        return any(m.is_stale() for m in self.children)
+
+    def __getitem__(self, key: str) -> Any:
+        self.load()
+        return super().__getitem__(key)
+
+    def __contains__(self, key: object) -> bool:
+        self.load()
+        return super().__contains__(key)
+
+    def __iter__(self) -> Iterator[str]:
+        self.load()
+        return super().__iter__()
+
+    def __len__(self) -> int:
+        self.load()
+        return super().__len__()
+
+    def __eq__(self, other: object) -> bool:
+        self.load()
+        return super().__eq__(other)
+
+    __hash__ = None  # type: ignore
+
+    def get(self, key: str, default: Any = None) -> Any:
+        self.load()
+        return super().get(key, default)
+
+    def keys(self) -> "dict_keys[str, Any]":
+        self.load()
+        return super().keys()
+
+    def values(self) -> "dict_values[str, Any]":
+        self.load()
+        return super().values()
+
+    def items(self) -> "dict_items[str, Any]":
+        self.load()
+        return super().items()
+
+    def __deepcopy__(self, memo: dict[int, Any]) -> dict[str, Any]:
+        return copy.deepcopy(dict(self.items()), memo)
+
+    def __repr__(self) -> str:
+        if not self.loaded:
+            return f"MountedDict({self.spec!r})"
+        return super().__repr__()
+
+
+def is_mount(v: Any) -> bool:
+    return isinstance(v, MountedDict) or (
+        isinstance(v, dict)
+        and isinstance(RawDict.get(cast(RawDict, v), MOUNT_KEY), str)
+    )
+
+
+def load_file(path: str) -> "PromptLibrary":
+    from .prompt import PromptFile
+
+    return PromptFile(path).load_library()
+
+
+def load_directory(path: str) -> dict[str, Any]:
+    r: dict[str, Any] = {}
+    for name in sorted(os.listdir(path)):
+        if os.path.isdir(os.path.join(path, name)):
+            r[name] = MountedDict({MOUNT_KEY: name + "/"}, path)
+        else:
+            stem, ext = os.path.splitext(name)
+            if ext in PROMPT_EXTS and stem not in r:
+                r[stem] = MountedDict({MOUNT_KEY: name}, path)
+    return r
+
+
+def find_mounts(d: dict[str, Any]) -> list[list[str]]:
+    r: list[list[str]] = []
+    stack: list[tuple[list[str], dict[str, Any]]] = [([], d)]
+    while stack:
+        prefix, v = stack.pop()
+        for k, child in RawDict.items(v):
+            if not isinstance(child, dict):
+                continue
+            if is_mount(child):
+                r += [prefix + [k]]
+            else:
+                stack += [(prefix + [k], cast(dict[str, Any], child))]
+    return r
+
+
+def wrap_mounts(
+    d: dict[str, Any], mounts: list[list[str]], root_dir: str
+) -> list[MountedDict]:
+    r: list[MountedDict] = []
+    for keys in mounts:
+        parent = d
+        for key in keys[:-1]:
+            parent = cast(dict[str, Any], RawDict.__getitem__(parent, key))
+        spec = RawDict.__getitem__(parent, keys[-1])
+        if not isinstance(spec, MountedDict):
+            spec = MountedDict(spec, root_dir)
+            RawDict.__setitem__(parent, keys[-1], spec)
+        r += [spec]
+    return r
@@ -0,0 +1,184 @@
+from typing import Any, Callable, cast
+
+import threading
+
+from .cache import LRUCache
+from .key_index import KeyPathIndex
+from .template import TemplateCache
+from .loaded_keys import KeyList
+from .sampler import (
+    KeySampler,
+    InclusionSampler,
+    build_key_sampler,
+    build_inclusion_sampler,
+)
+from .overlay import PromptOverlay
+from .sqlite_store import SqliteDict
+
+MISSING: Any = object()
+
+
+# ノードごとに一度だけ計算する情報
+class NodeMeta:
+    __slots__ = (
+        "keys",
+        "conds",
+        "static",
+        "has_t",
+        "has_effects",
+        "w",
+        "r",
+        "post",
+        "paths",
+        "samplers",
+        "inclusion",
+    )
+
+    def __init__(self, d: dict[str, Any]):
+        if "_k" in d:
+            self.keys = [(i, str(k)) for i, k in enumerate(d["_k"]) if k in d]
+        else:
+            self.keys = list(enumerate([k for k in d.keys() if not k.startswith("_")]))
+        # 子ノードの(_when, _when_not) 子を読み込まないよう必要になるまで計算しない
+        self.conds: list[tuple[Any, Any] | None] | None = None
+        # 子ノードに_when/_when_notがなく選択肢がloaded_keysに依存しないか
+        self.static: bool | None = None
+        self.has_t = "_t" in d
+        # collect_promptで辿った時に処理が必要なキーを持つか
+        self.has_effects = "_exports" in d or "_post" in d or "_random_count" in d
+        self.w: list[Any] | None = d.get("_w", None)
+        self.r: list[Any] | None = d.get("_r", None)
+        self.post: list[str] | None = d.get("_post", None)
+        # 子孫の全キーパスの索引 <?route find/remove>で初めて構築する
+        self.paths: KeyPathIndex | None = None
+        # 終端で絞り込むか(None: 絞り込まない) -> 重み付き選択
+        self.samplers: dict[bool | None, KeySampler | None] = {}
+        self.inclusion: InclusionSampler | None = None
+
+    def get_conds(self, d: dict[str, Any]) -> list[tuple[Any, Any] | None]:
+        if self.conds is None:
+            conds: list[tuple[Any, Any] | None] = []
+            for _, k in self.keys:
+                v = d[k]
+                if isinstance(v, dict) and ("_when" in v or "_when_not" in v):
+                    target = cast(dict[str, Any], v)
+                    conds += [
+                        (
+                            target.get("_when", MISSING),
+                            target.get("_when_not", MISSING),
+                        )
+                    ]
+                else:
+                    conds += [None]
+            self.conds = conds
+        return self.conds
+
+    def is_static(self, d: dict[str, Any]) -> bool:
+        if self.static is None:
+            self.static = all(c is None for c in self.get_conds(d))
+        return self.static
+
+    def filter_keys(
+        self, d: dict[str, Any], loaded_keys: KeyList | None
+    ) -> list[tuple[int, str]]:
+        if loaded_keys is None:
+            return list(self.keys)
+        return [
+            ik
+            for ik, c in zip(self.keys, self.get_conds(d))
+            if c is None
+            or (
+                (c[0] is MISSING or c[0] in loaded_keys)
+                and (c[1] is MISSING or c[1] not in loaded_keys)
+            )
+        ]
+
+
+class NodeIndex:
+    def __init__(self, sqlite_entries: int = 65536, sampler: str = "cumulative"):
+        self.sampler = sampler
+        self.templates = TemplateCache()
+        # id -> (ノード, 情報) ノードを保持してidの再利用を防ぐ
+        self.nodes: dict[int, tuple[dict[str, Any], NodeMeta]] = {}
+        self.sqlite_nodes = LRUCache(max_bytes=1 << 62, max_entries=sqlite_entries)
+        self.lock = threading.Lock()
+
+    def get(self, d: dict[str, Any]) -> NodeMeta:
+        if isinstance(d, SqliteDict):
+            return self.sqlite_nodes.get_or_create(
+                (id(d.store), d.node_id), lambda: (NodeMeta(d), 1)
+            )
+        r = self.nodes.get(id(d), None)
+        if r is None:
+            meta = NodeMeta(d)
+            with self.lock:
+                self.nodes[id(d)] = (d, meta)
+            return meta
+        return r[1]
+
+    def is_term(self, v: Any) -> bool:
+        if isinstance(v, str):
+            return True
+        if isinstance(v, dict):
+            return len(self.get(cast(dict[str, Any], v)).keys) == 0
+        return len(cast(dict[str, Any], v).keys()) == 0
+
+    def get_sampler(
+        self, d: dict[str, Any], term: bool | None, loaded_keys: KeyList | None
+    ) -> KeySampler | None:
+        meta = self.get(d)
+        static = loaded_keys is None or meta.is_static(d)
+        if static and term in meta.samplers:
+            return meta.samplers[term]
+        keys = meta.filter_keys(d, loaded_keys)
+        if term is not None:
+            keys = [(i, k) for i, k in keys if self.is_term(d[k]) == term]
+        sampler = build_key_sampler(keys, meta.w, self.sampler)
+        if static:
+            meta.samplers[term] = sampler
+        return sampler
+
+    def get_inclusion(
+        self, d: dict[str, Any], keys: list[tuple[int, str]], static: bool
+    ) -> InclusionSampler | None:
+        meta = self.get(d)
+        if static and meta.inclusion is not None:
+            return meta.inclusion
+        inclusion = build_inclusion_sampler(keys, cast(list[Any], meta.r))
+        if static:
+            meta.inclusion = inclusion
+        return inclusion
+
+    def find_keys(
+        self, d: dict[str, Any], sub: str, build: Callable[[], list[str]]
+    ) -> list[str]:
+        meta = self.get(d)
+        if meta.paths is None:
+            meta.paths = KeyPathIndex(build())
+        return meta.paths.find(sub)
+
+
+# デコードごとのインデックス
+# オーバーレイで書き込まれたノードだけ個別に計算し、書き込み時に破棄する
+class DecodeNodeIndex(NodeIndex):
+    def __init__(self, base: NodeIndex, overlay: PromptOverlay):
+        super().__init__(sampler=base.sampler)
+        self.templates = base.templates
+        self.base = base
+        self.overlay = overlay
+
+    def get(self, d: dict[str, Any]) -> NodeMeta:
+        if self.overlay.is_owned(d):
+            return NodeIndex.get(self, d)
+        return self.base.get(d)
+
+    def find_keys(
+        self, d: dict[str, Any], sub: str, build: Callable[[], list[str]]
+    ) -> list[str]:
+        # 書き込まれたノードはデコード中に変わり得るので索引を作らず走査する
+        if self.overlay.is_owned(d):
+            return [k for k in build() if sub in k]
+        return self.base.find_keys(d, sub, build)
+
+    def invalidate(self):
+        self.nodes.clear()
@@ -0,0 +1,89 @@
+from typing import Iterable, Iterator
+
+BRACKETS = str.maketrans("([{)]}", "((()))")
+
+
+def normalize_prompt(s: str, dedupe: bool = False) -> str:
+    # 空白をまとめ、", "と連続する","と".,"を","に詰める
+    # 正規表現4回と同じ結果を文字列メソッドだけで得る
+    r = " ".join(s.split())
+    if r:
+        if s[0].isspace():
+            r = " " + r
+        if s[-1].isspace():
+            r += " "
+    elif s:
+        r = " "
+    r = r.replace(", ", ",")
+    while ",," in r:
+        r = r.replace(",,", ",")
+    r = r.replace(".,", ".")
+    r = r[1:] if r.startswith(",") else r
+    return dedupe_tags(r) if dedupe else r
+
+
+def split_tags(s: str) -> list[str]:
+    # 括弧の中の","では区切らない
+    r: list[str] = []
+    depth = 0
+    for part in s.split(","):
+        if depth > 0:
+            r[-1] += "," + part
+        else:
+            r += [part]
+        t = part.translate(BRACKETS)
+        depth = max(0, depth + t.count("(") - t.count(")"))
+    return r
+
+
+def dedupe_tags(s: str) -> str:
+    # 最初に現れたタグだけを残す
+    seen: set[str] = set()
+    r: list[str] = []
+    for tag in split_tags(s):
+        key = tag.strip()
+        if key:
+            if key in seen:
+                continue
+            seen.add(key)
+        r += [tag]
+    return ",".join(r)
+
+
+# handle_dataで追加されるプロンプトの断片
+# 連結される断片(simple_join)は最後にまとめてjoinする
+class PromptFragments:
+    def __init__(self, fragments: Iterable[str] = ()):
+        self.fragments: list[list[str]] = [[v] for v in fragments]
+
+    def append(self, data: str):
+        self.fragments += [[data]]
+
+    def extend_last(self, data: str):
+        self.fragments[-1] += [data]
+
+    def __iadd__(self, fragments: Iterable[str]):
+        for v in fragments:
+            self.append(v)
+        return self
+
+    def __iter__(self) -> Iterator[str]:
+        return ("".join(f) for f in self.fragments)
+
+    def __len__(self) -> int:
+        return len(self.fragments)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, PromptFragments):
+            return list(self) == list(other)
+        return list(self) == other
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        return f"PromptFragments({list(self)!r})"
+
+    def build(self, dedupe: bool = False) -> str:
+        return normalize_prompt(
+            ",".join([v for v in [v.strip() for v in self] if v]), dedupe
+        )
@@ -0,0 +1,43 @@
+from typing import Any, cast
+
+type PromptDict = dict[str, Any]
+
+
+# 共有されたPromptDictのコピーオンライトビュー
+# 読み込みはベースをそのまま参照し、書き込むノードとそこまでのパス上の辞書だけを一度浅くコピーする
+class PromptOverlay:
+    def __init__(self, base: PromptDict):
+        self.base = base
+        self.root: PromptDict = dict(base)
+        self.owned: dict[int, PromptDict] = {id(self.root): self.root}
+
+    def is_owned(self, d: PromptDict) -> bool:
+        return id(d) in self.owned
+
+    def is_shared(self, keys: list[str], value: Any) -> bool:
+        # keysの値がベースのオブジェクトそのものか (このデコードで書き込まれていないか)
+        d: Any = self.base
+        try:
+            for key in keys:
+                d = d[key]
+        except (KeyError, TypeError):
+            return False
+        return d is value
+
+    def child(self, parent: PromptDict, key: str) -> Any:
+        assert self.is_owned(parent), "Parent is not writable."
+        v = parent[key]
+        if isinstance(v, dict) and not self.is_owned(cast(PromptDict, v)):
+            v = dict(cast(PromptDict, v))
+            self.owned[id(v)] = v
+            parent[key] = v
+        return cast(Any, v)
+
+    def writable(self, keys: list[str], start: PromptDict | None = None) -> PromptDict:
+        d = self.root if start is None else start
+        for key in keys:
+            d = cast(PromptDict, self.child(d, key))
+        return d
+
+    def delta_size(self) -> int:
+        return len(self.owned)
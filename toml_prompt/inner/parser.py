@@ -1,136 +1,192 @@
-from typing import Self, Any, Callable, cast, TypeVar
+from typing import Self, Any, Callable, Iterable, Iterator, Sequence, cast, TypeVar
 import os
 import re
 import shlex
-from html.parser import HTMLParser
 
 from .prompt import (
     PromptFile,
     PromptDict,
-    build_search_keys,
+    PromptLibrary,
+    iter_search_keys,
     collect_prompt,
     load_prompt_var,
     get_keys_all,
-    get_keys_all_recursive,
+    find_keys,
 )
-from .util import Random
+from .overlay import PromptOverlay
+from .loaded_keys import LoadedKeys
+from .normalize import PromptFragments
+from .node_index import DecodeNodeIndex
+from .wildcard import WildcardFile
+from .grep import GrepTermError, grep_values
+from .trace import tracer
+from .tokenizer import Event, expand_lora_tags, parse_events
+from .util import new_random
 
 type AttrType = dict[str, str | None]
+# 入れ子で評価するプロンプトと連結方法
+type Expansion = tuple[str, bool]
+type Evaluation = Iterator[Expansion]
 T = TypeVar("T")
 
 
-class PromptTagParser(HTMLParser):
-    def __init__(
-        self,
-        prompt: PromptFile | None = None,
-        other: Self | None = None,
-        seed: int | None = None,
-        simple_join: bool = False,
-    ):
-        HTMLParser.__init__(self)
-        if prompt is not None:
-            self.positive: list[str] = []
-            self.negative: list[str] = []
-            self.loras: list[str] = []
-            self.loras_low: list[str] = []
-            self.loaded_keys: list[str] = []
-            self.prompt_dict = prompt.load()
-            self.root_dir = os.path.dirname(prompt.path)
-            self.exports: dict[str, str] = {}
-            self.random = Random(seed=seed)
-        elif other is not None:
-            self.positive = other.positive
-            self.negative = other.negative
-            self.loras = other.loras
-            self.loras_low = other.loras_low
-            self.loaded_keys = other.loaded_keys
-            self.prompt_dict = other.prompt_dict
-            self.root_dir = other.root_dir
-            self.exports = other.exports
-            self.random = other.random
+# <raw>...</raw>ごとの評価状態
+class Frame:
+    __slots__ = ("tag", "cond", "random_key", "simple_join", "before_simple_join")
+
+    def __init__(self, simple_join: bool = False):
         self.tag: list[tuple[str, dict[str, str | None]]] = []
         self.cond: list[bool] = []
         self.random_key: list[str] = []
         self.simple_join = simple_join
         self.before_simple_join = False
 
-    def feed(self, data: str):
-        def replace(m: re.Match[str]) -> str:
-            if m.group(5) is not None:
-                return f'<?{m.group(1)} "{m.group(2)}" "{m.group(3)}" "{m.group(5)}">'
-            else:
-                return f'<?{m.group(1)} "{m.group(2)}" "{m.group(3)}">'
 
-        data = re.sub(
-            r"<(lora[_a-z]*):([^:>]+):([0-9\-.]+)(:([0-9\-.]+))?>",
-            replace,
-            data,
-            flags=re.MULTILINE,
-        )
-        return HTMLParser.feed(self, data)
+class PromptTagParser:
+    # 入れ子の展開の深さの上限
+    max_depth = 1024
 
-    def feed_new_obj(self, prompt: str, simple_join: bool):
-        parser = PromptTagParser(other=self, simple_join=simple_join)
-        parser.feed(f"<raw>{prompt}</raw>")
-        assert (
-            len(parser.tag) == 0
-            and len(parser.cond) == 0
-            and len(parser.random_key) == 0
-        ), f"Tag not closed. {prompt}"
+    def __init__(
+        self,
+        prompt: PromptFile,
+        seed: int | None = None,
+        simple_join: bool = False,
+        max_depth: int | None = None,
+        library: PromptLibrary | None = None,
+    ):
+        self.positive = PromptFragments()
+        self.negative = PromptFragments()
+        self.loras: list[str] = []
+        self.loras_low: list[str] = []
+        if library is None:
+            library = prompt.load_library()
+        self.loaded_keys = LoadedKeys(interner=library.key_interner)
+        self.overlay = PromptOverlay(library.prompt_dict)
+        self.prompt_dict = self.overlay.root
+        self.node_index = DecodeNodeIndex(library.node_index, self.overlay)
+        self.root_dir = os.path.dirname(prompt.path)
+        self.exports: dict[str, str] = {}
+        self.random = new_random(seed, library.rng)
+        if max_depth is not None:
+            self.max_depth = max_depth
+        self.root = Frame(simple_join)
+        self.frame = self.root
+        # トレースのデコードID tracer.get(decode_id)で読む
+        self.decode_id = tracer.new_decode()
+
+    def feed(self, data: str):
+        self.feed_events(parse_events(expand_lora_tags(data)))
+
+    def feed_events(self, events: list[Event]):
+        # 展開されたプロンプトは再帰せず明示的なスタックで評価する
+        frames = [self.root]
+        stack = [self.eval_events(events, None)]
+        with tracer.scope(self.decode_id):
+            try:
+                while stack:
+                    self.frame = frames[-1]
+                    expansion = next(stack[-1], None)
+                    if expansion is None:
+                        frames.pop()
+                        stack.pop()
+                        continue
+                    if len(stack) > self.max_depth:
+                        raise RecursionError(
+                            f"Prompt nesting too deep (max_depth={self.max_depth})."
+                        )
+                    prompt, simple_join = expansion
+                    frames += [Frame(simple_join)]
+                    stack += [
+                        self.eval_events(
+                            parse_events(expand_lora_tags(f"<raw>{prompt}</raw>")),
+                            prompt,
+                        )
+                    ]
+            finally:
+                self.frame = self.root
+
+    def eval_events(self, events: list[Event], prompt: str | None) -> Evaluation:
+        for event in events:
+            kind = event[0]
+            if kind == "data":
+                yield from self.handle_data(event[1])
+            elif kind == "pi":
+                yield from self.handle_pi(event[1])
+            elif kind == "start":
+                self.handle_starttag(event[1], cast(Any, event)[2])
+            else:
+                self.handle_endtag(event[1])
+        if prompt is not None:
+            f = self.frame
+            assert (
+                len(f.tag) == 0 and len(f.cond) == 0 and len(f.random_key) == 0
+            ), f"Tag not closed. {prompt}"
 
     def tag_case(self, attrs: AttrType):
-        self.cond += [len(self.cond) == 0 or self.cond[-1] == True]
+        f = self.frame
+        f.cond += [len(f.cond) == 0 or f.cond[-1] == True]
 
     def tag_random(self, attrs: AttrType):
-        if len(self.cond) == 0 or self.cond[-1] == True:
-            self.cond += [True]
+        f = self.frame
+        if len(f.cond) == 0 or f.cond[-1] == True:
+            f.cond += [True]
             choices = [k for k in attrs.keys()]
             weights = [float(v) for v in attrs.values() if v is not None]
             key = self.random.choices(choices, weights)[0]
-            print(f"Random: {key} in {choices}")
-            self.random_key += [key]
+            if tracer.enabled:
+                tracer.emit("random", key=key, choices=choices)
+            f.random_key += [key]
         else:
-            self.cond += [False]
-            self.random_key += [""]
+            f.cond += [False]
+            f.random_key += [""]
 
     def tag_when(self, attrs: AttrType):
-        self.cond += [
-            (len(self.cond) == 0 or self.cond[-1] == True)
+        f = self.frame
+        f.cond += [
+            (len(f.cond) == 0 or f.cond[-1] == True)
             and attrs["key"] in self.loaded_keys
         ]
-        if self.cond[-1]:
-            print("When:", attrs["key"])
+        if f.cond[-1]:
+            if tracer.enabled:
+                tracer.emit("when", key=attrs["key"])
 
     def tag_case_when(self, attrs: AttrType):
-        if self.cond[-1] == True:
+        f = self.frame
+        if f.cond[-1] == True:
             if attrs["key"] in self.loaded_keys:
-                self.cond[-1] = False
-                self.cond += [True]
-                print("Case:", attrs["key"])
+                f.cond[-1] = False
+                f.cond += [True]
+                if tracer.enabled:
+                    tracer.emit("case", key=attrs["key"])
             else:
-                self.cond += [False]
+                f.cond += [False]
         else:
-            self.cond += [False]
+            f.cond += [False]
 
     def tag_random_when(self, attrs: AttrType):
-        if self.cond[-1] == True:
-            if attrs["key"] == self.random_key[-1]:
-                self.cond[-1] = False
-                self.cond += [True]
-                print("Random:", attrs["key"])
+        f = self.frame
+        if f.cond[-1] == True:
+            if attrs["key"] == f.random_key[-1]:
+                f.cond[-1] = False
+                f.cond += [True]
+                if tracer.enabled:
+                    tracer.emit("random_when", key=attrs["key"])
             else:
-                self.cond += [False]
+                f.cond += [False]
         else:
-            self.cond += [False]
+            f.cond += [False]
 
     def tag_else(self, attrs: AttrType):
-        self.cond += [self.cond[-1] == True]
-        if self.cond[-1]:
-            print("Else")
+        f = self.frame
+        f.cond += [f.cond[-1] == True]
+        if f.cond[-1]:
+            if tracer.enabled:
+                tracer.emit("else")
 
     def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]):
+        f = self.frame
         dict_attrs = dict(attrs)
-        parent_tag = self.tag[-1][0] if len(self.tag) > 0 else "tag"
+        parent_tag = f.tag[-1][0] if len(f.tag) > 0 else "tag"
         if tag == "when":
             if parent_tag == "case":
                 self.tag_case_when(dict_attrs)
@@ -145,58 +201,53 @@ class PromptTagParser(HTMLParser):
         elif tag == "random":
             self.tag_random(dict_attrs)
 
-        self.tag += [(tag, dict_attrs)]
-        return HTMLParser.handle_starttag(self, tag, attrs)
+        f.tag += [(tag, dict_attrs)]
 
     def handle_endtag(self, tag: str):
-        assert self.tag[-1][0] == tag, f"{tag} != {self.tag}[-1][0]"
-        self.tag.pop(-1)
+        f = self.frame
+        assert f.tag[-1][0] == tag, f"{tag} != {f.tag}[-1][0]"
+        f.tag.pop(-1)
         if tag in ["case", "when", "else", "random"]:
-            _cond = self.cond.pop(-1)
+            _cond = f.cond.pop(-1)
         if tag == "random":
-            self.random_key.pop(-1)
-        return HTMLParser.handle_endtag(self, tag)
+            f.random_key.pop(-1)
 
-    def handle_startendtag(self, tag: str, attrs: list[tuple[str, str | None]]):
-        self.handle_starttag(tag, attrs)
-        self.handle_endtag(tag)
-
-    def handle_data(self, data: str):
+    def handle_data(self, data: str) -> Evaluation:
+        f = self.frame
         # Condition is not True
-        if len(self.cond) > 0 and not self.cond[-1]:
-            return HTMLParser.handle_data(self, data)
+        if len(f.cond) > 0 and not f.cond[-1]:
+            return
 
-        tag = self.tag[-1][0] if len(self.tag) > 0 else "tag"
+        tag = f.tag[-1][0] if len(f.tag) > 0 else "tag"
         if tag == "raw" or tag == "when" or tag == "else":
             if data.strip():
-                if (self.simple_join or self.before_simple_join) and self.positive:
-                    self.positive[-1] += data
-                    self.before_simple_join = False
+                if (f.simple_join or f.before_simple_join) and self.positive:
+                    self.positive.extend_last(data)
+                    f.before_simple_join = False
                 else:
-                    self.positive += [data]
+                    self.positive.append(data)
         elif tag == "neg":
             if data.strip():
-                self.negative += [data]
+                self.negative.append(data)
         elif tag == "tag" or tag == "var":
             for key in re.split(r"[,\r\n]", data):
                 key = key.strip()
                 post_keys: list[str] = []
-                keys = build_search_keys(key)
+                keys = iter_search_keys(key, self.prompt_dict)
                 simple_join = tag == "var"
-                self.feed_prompt(keys, post_keys, simple_join)
+                yield from self.feed_prompt(keys, post_keys, simple_join)
                 while post_keys:
                     keys = post_keys
                     post_keys = []
-                    self.feed_prompt(keys, post_keys, simple_join)
+                    yield from self.feed_prompt(keys, post_keys, simple_join)
         else:
             assert (
                 data.strip() == "" or data.strip() == ","
             ), f"Unknown Data: {data} in {tag}"
-        return HTMLParser.handle_data(self, data)
 
     def load_lora_tag(
         self, lora_name: str, strength_model: str, strength_clip: str | None, low: bool
-    ):
+    ) -> Evaluation:
         lora_name = lora_name.replace(os.path.sep, "/")
         if strength_clip is None:
             lora_tag = "<lora:{}:{}>".format(lora_name, strength_model)
@@ -219,18 +270,18 @@ class PromptTagParser(HTMLParser):
             if lora_name_key in lora_dict:
                 keys = [["<lora>", lora_name_key]]
                 post_keys: list[str] = []
-                self.feed_prompt(keys, post_keys)
+                yield from self.feed_prompt(keys, post_keys)
                 while post_keys:
                     keys = post_keys
                     post_keys = []
-                    self.feed_prompt(keys, post_keys)
+                    yield from self.feed_prompt(keys, post_keys)
 
     def feed_prompt(
         self,
-        keys: list[str] | list[list[str]],
+        keys: Iterable[str] | list[list[str]],
         post_keys: list[str] | None = None,
         simple_join: bool = False,
-    ):
+    ) -> Evaluation:
         if post_keys is None:
             post_keys = []
         prompt = ",".join(
@@ -244,24 +295,26 @@ class PromptTagParser(HTMLParser):
                     exports=self.exports,
                     root_dir=self.root_dir,
                     post_keys=post_keys,
+                    index=self.node_index,
                 )
                 if v.strip()
             ]
         )
         if prompt:
-            self.feed_new_obj(prompt, simple_join=simple_join)
-            self.before_simple_join = simple_join
+            f = self.frame
+            yield (prompt, simple_join)
+            f.before_simple_join = simple_join
 
-    def pi_lora(self, args: list[str]):
-        self.load_lora_tag(
+    def pi_lora(self, args: list[str]) -> Evaluation:
+        return self.load_lora_tag(
             args[0],
             args[1] if len(args) >= 2 else "1.0",
             args[2] if len(args) >= 3 else None,
             False,
         )
 
-    def pi_lora_low(self, args: list[str]):
-        self.load_lora_tag(
+    def pi_lora_low(self, args: list[str]) -> Evaluation:
+        return self.load_lora_tag(
             args[0],
             args[1] if len(args) >= 2 else "1.0",
             args[2] if len(args) >= 3 else None,
@@ -269,49 +322,68 @@ class PromptTagParser(HTMLParser):
         )
 
     def pi_set(self, args: list[str]):
-        d = self.prompt_dict
         keys = args[0].strip().split(".")
-        d, _ = load_prompt_var(d, keys, self.root_dir)
+        load_prompt_var(self.prompt_dict, keys, self.root_dir)
+        d = self.overlay.writable(keys[:-1])
         d[keys[-1]] = [args[1]]
-        print("Set:", args[0], "=", args[1])
+        self.node_index.invalidate()
+        if tracer.enabled:
+            tracer.emit("set", key=args[0], value=args[1])
 
     def pi_grep(self, args: list[str]):
-        d = self.prompt_dict
         keys = args[0].strip().split(".")
-        d, values = load_prompt_var(d, keys, self.root_dir)
-        d[keys[-1]] = [
-            k
-            for k in (values if isinstance(values, list) else [values])
-            if args[1] in k
-        ]
-        print("Grep:", cast(list[Any], d[keys[-1]]))
-
-    def pi_route(self, args: list[str]):
         d = self.prompt_dict
-        for key in args[1].strip().split("."):
+        for key in keys[:-1]:
             d = cast(PromptDict, d[key])
+        source = d[keys[-1]]
+        if isinstance(source, list) and self.overlay.is_shared(keys, source):
+            # ライブラリのリストをそのまま使い、結果をキャッシュする
+            values: Sequence[Any] = cast(list[Any], source)
+            shared = True
+        else:
+            _, v = load_prompt_var(self.prompt_dict, keys, self.root_dir)
+            values = v if isinstance(v, (list, WildcardFile)) else [v]
+            shared = isinstance(v, WildcardFile)
+        try:
+            r = grep_values(values, tuple(args[1:]), shared)
+        except GrepTermError as e:
+            raise Exception(
+                f"Invalid grep term: key={args[0]}, term={e.term} ({e.error})"
+            ) from e
+        d = self.overlay.writable(keys[:-1])
+        d[keys[-1]] = r
+        self.node_index.invalidate()
+        if tracer.enabled:
+            tracer.emit("grep", key=args[0], values=d[keys[-1]])
+
+    def pi_route(self, args: list[str]):
+        route = args[1].strip().split(".")
+        keys: list[str] = []
+        if args[0] in ["find", "remove"]:
+            # 書き込み前のノードで検索して共有ノードの索引を使う
+            src = self.prompt_dict
+            for key in route:
+                src = cast(PromptDict, src[key])
+            keys = find_keys(src, args[2], index=self.node_index)
+        d = self.overlay.writable(route)
 
         if args[0] == "fix":
-            fix_route(d, args[2:])
+            fix_route(self.overlay, d, args[2:])
         elif args[0] == "find":
-            keys = get_keys_all_recursive(d)
-            all_keys = keys[0] + keys[1]
-            keys = [k for k in all_keys if args[2] in k]
-            fix_route(d, keys)
+            fix_route(self.overlay, d, keys)
         elif args[0] == "remove":
-            keys = get_keys_all_recursive(d)
-            all_keys = keys[0] + keys[1]
-            keys = [k for k in all_keys if args[2] in k]
-            remove_route(d, keys)
+            remove_route(self.overlay, d, keys)
+        self.node_index.invalidate()
 
     def pi_export(self, args: list[str]):
         self.exports[args[0]] = args[1]
-        print("Export:", args[0], "=", args[1])
+        if tracer.enabled:
+            tracer.emit("export", key=args[0], value=args[1])
 
     def pi_random_count(self, args: list[str]):
         self.random.set_count(int(args[0]))
 
-    PI_FUNCS: dict[str, Callable[[Self, list[str]], None]] = {
+    PI_FUNCS: dict[str, Callable[[Self, list[str]], Evaluation | None]] = {
         "export": pi_export,
         "route": pi_route,
         "grep": pi_grep,
@@ -324,17 +396,19 @@ class PromptTagParser(HTMLParser):
         "random_count": pi_random_count,
     }
 
-    def handle_pi(self, data: str):
+    def handle_pi(self, data: str) -> Evaluation:
+        f = self.frame
         # Condition is not True
-        if len(self.cond) > 0 and not self.cond[-1]:
-            return HTMLParser.handle_pi(self, data)
+        if len(f.cond) > 0 and not f.cond[-1]:
+            return
 
         args = shlex.split(data)
-        self.PI_FUNCS[args[0]](self, args[1:])
-        return HTMLParser.handle_pi(self, data)
+        evaluation = self.PI_FUNCS[args[0]](self, args[1:])
+        if evaluation is not None:
+            yield from evaluation
 
 
-def fix_route(d: PromptDict, keys: list[str]):
+def fix_route(overlay: PromptOverlay, d: PromptDict, keys: list[str]):
     start = d
     for key in keys:
         d = start
@@ -343,29 +417,29 @@ def fix_route(d: PromptDict, keys: list[str]):
                 d["_k"] = []
                 d["_w"] = []
                 d["_fix"] = True
-            d = cast(PromptDict, d[elem])
+            d = cast(PromptDict, overlay.child(d, elem))
     for key in keys:
         d = start
         for elem in key.split("."):
             if elem not in d.get("_k", []):
                 if "_k" in d and isinstance(d["_k"], list):
-                    d["_k"] += [elem]
+                    d["_k"] = d["_k"] + [elem]
                 else:
                     d["_k"] = [elem]
                 if "_w" in d and isinstance(d["_w"], list):
-                    d["_w"] += [1.0]
+                    d["_w"] = d["_w"] + [1.0]
                 else:
                     d["_w"] = [1.0]
-            d = cast(PromptDict, d[elem])
+            d = cast(PromptDict, overlay.child(d, elem))
 
 
-def remove_route(d: PromptDict, keys: list[str]):
+def remove_route(overlay: PromptOverlay, d: PromptDict, keys: list[str]):
     start = d
     for key in keys:
         d = start
         l = key.split(".")
         for elem in l[:-1]:
-            d = cast(PromptDict, d[elem])
+            d = cast(PromptDict, overlay.child(d, elem))
         elem = l[-1]
 
         if "_k" not in d:
@@ -373,6 +447,8 @@ def remove_route(d: PromptDict, keys: list[str]):
 
         if elem in d["_k"]:
             i = cast(list[str], d["_k"]).index(elem)
-            cast(list[str], d["_k"]).remove(elem)
+            d["_k"] = [k for k in cast(list[str], d["_k"]) if k != elem]
             if "_w" in d:
-                cast(list[float], d["_w"]).pop(i)
+                d["_w"] = [
+                    w for j, w in enumerate(cast(list[float], d["_w"])) if j != i
+                ]
@@ -0,0 +1,32 @@
+from .cache import LRUCache
+from .template import Template, compile_template
+from .tokenizer import Event, expand_lora_tags, parse_events
+from .util import Random
+
+
+# key_name_listのデコード計画
+# コメント削除・{a|b}の分割・<lora:...>の変換・構文解析を済ませ、シードごとには選択だけを行う
+class DecodePlan:
+    def __init__(self, key_name_list: str, max_variants: int = 256):
+        self.template: Template = compile_template(key_name_list)
+        # {a|b}の選択結果ごとの構文解析結果 (選択肢がなければ1つだけ)
+        self.variants = LRUCache(max_bytes=1 << 62, max_entries=max_variants)
+
+    def parse(self, data: str) -> list[Event]:
+        return self.variants.get_or_create(
+            data, lambda: (parse_events(expand_lora_tags(data)), 1)
+        )
+
+    def render(self, rand: Random) -> list[Event]:
+        return self.parse(self.template.render(rand))
+
+
+# ライブラリごとのデコード計画のキャッシュ key_name_list -> DecodePlan
+class PlanCache:
+    def __init__(self, max_entries: int = 256):
+        self.plans = LRUCache(max_bytes=1 << 62, max_entries=max_entries)
+
+    def get(self, key_name_list: str) -> DecodePlan:
+        return self.plans.get_or_create(
+            key_name_list, lambda: (DecodePlan(key_name_list), 1)
+        )
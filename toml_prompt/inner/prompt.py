@@ -1,100 +1,240 @@
-from typing import Any, cast
+from typing import Any, Callable, Iterable, Iterator, cast
 
 import os
-import re
-import functools
+import copy
+import hashlib
 import tomllib
 import yaml
 
-from .util import Random
+from .util import RNGS, RNG_KEY, Random
+from .cache import CacheKey, prompt_dict_cache, wildcard_cache
+from .snapshot import snapshot_path, dump_snapshot, load_snapshot
+from .wildcard import WildcardFile
+from .mount import MountedDict, find_mounts, wrap_mounts
+from .sqlite_store import SQLITE_EXTS, SqlitePromptStore
+from .node_index import NodeIndex
+from .plan import PlanCache
+from .trace import tracer
+from .loaded_keys import KeyInterner, KeyList, LoadedKeys
+from .sampler import SAMPLERS, SAMPLER_KEY
+from .template import (
+    COMMENT_PATTERN,
+    CHOICE_PATTERN,
+    expand_var_refs,
+)
 
 type PromptDict = dict[str, Any | list[Any] | PromptDict]
 
+# ライブラリごとに一度だけ構築してスナップショットにも保存する派生インデックス
+INDEX_BUILDERS: dict[str, Callable[[PromptDict], Any]] = {}
+
+
+def register_index(name: str):
+    def deco(f: Callable[[PromptDict], Any]):
+        INDEX_BUILDERS[name] = f
+        return f
+
+    return deco
+
+
+class PromptLibrary:
+    def __init__(self, prompt_dict: PromptDict, indexes: dict[str, Any] | None = None):
+        self.prompt_dict = prompt_dict
+        self.indexes: dict[str, Any] = {} if indexes is None else indexes
+        self.mounted: list[MountedDict] = []
+        # validate_prompt_dictで値は検証済み
+        self.node_index = NodeIndex(
+            sampler=cast(str, prompt_dict.get(SAMPLER_KEY, SAMPLERS[0]))
+        )
+        self.rng: str = cast(str, prompt_dict.get(RNG_KEY, RNGS[0]))
+        # ライブラリはファイルの内容ごとにキャッシュされるので、計画もライブラリ単位で持つ
+        self.plans = PlanCache()
+        # 読み込み済みキーのIDもライブラリ単位で持ち、キャッシュから外れたら解放する
+        self.key_interner = KeyInterner()
+
+    def get_index(self, name: str) -> Any:
+        if name not in self.indexes:
+            self.indexes[name] = INDEX_BUILDERS[name](self.prompt_dict)
+        return self.indexes[name]
+
+    def build_indexes(self):
+        for name in INDEX_BUILDERS.keys():
+            self.get_index(name)
+
+    def mount(self, root_dir: str):
+        self.mounted = wrap_mounts(self.prompt_dict, self.get_index("mounts"), root_dir)
+
+    def is_stale(self) -> bool:
+        # 読み込み済みの_include先が変更されたか
+        return any(m.is_stale() for m in self.mounted)
+
+
+register_index("mounts")(find_mounts)
+
+
+def validate_prompt_dict(d: PromptDict, prefix: str = ""):
+    for k, v in d.items():
+        key = f"{prefix}.{k}" if prefix else k
+        if k in ["_k", "_w", "_r", "_post"]:
+            if not isinstance(v, list):
+                raise Exception(f"Invalid value: {key} must be list.")
+        elif k == "_exports":
+            if not isinstance(v, dict):
+                raise Exception(f"Invalid value: {key} must be table.")
+        elif k == SAMPLER_KEY:
+            if v not in SAMPLERS:
+                raise Exception(f"Invalid value: {key} must be one of {SAMPLERS}.")
+        elif k == RNG_KEY:
+            if v not in RNGS:
+                raise Exception(f"Invalid value: {key} must be one of {RNGS}.")
+        elif isinstance(v, dict):
+            validate_prompt_dict(cast(PromptDict, v), key)
+
 
 class PromptFile:
+    auto_compile = True
+
     def __init__(self, path: str):
-        with open(path, "r", encoding="utf-8") as f:
-            self.text = f.read()
         self.path = path
         self.file_type = os.path.splitext(path)[1]
+        if self.file_type in SQLITE_EXTS:
+            # データベースは大きいので内容のハッシュは取らない
+            st = os.stat(path)
+            self.text = ""
+            self.cache_key: CacheKey = (
+                os.path.realpath(path),
+                st.st_size,
+                st.st_mtime_ns,
+                "",
+            )
+            return
+        with open(path, "rb") as f:
+            data = f.read()
+            st = os.fstat(f.fileno())
+        self.text = data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+        self.cache_key = (
+            os.path.realpath(path),
+            st.st_size,
+            st.st_mtime_ns,
+            hashlib.sha256(data).hexdigest(),
+        )
 
-    def load(self) -> PromptDict:
+    def parse(self) -> PromptDict:
         if self.file_type in [".toml", ".txt"]:
-            return cast(PromptDict, tomllib.loads(self.text))
+            d = cast(PromptDict, tomllib.loads(self.text))
         elif self.file_type in [".yaml", ".yml"]:
-            return yaml.safe_load(self.text)
+            d = yaml.safe_load(self.text)
         else:
             raise Exception(f"Unknown file type: {self.file_type}")
+        validate_prompt_dict(d)
+        return d
+
+    def compile(self, library: PromptLibrary | None = None) -> bool:
+        if library is None:
+            library = PromptLibrary(self.parse())
+        library.build_indexes()
+        return dump_snapshot(
+            snapshot_path(self.path),
+            self.cache_key[3],
+            library.prompt_dict,
+            library.indexes,
+        )
+
+    def load_compiled(self) -> PromptLibrary:
+        if self.file_type in SQLITE_EXTS:
+            store = SqlitePromptStore(self.path)
+            return PromptLibrary(store.root(), store.load_indexes())
+        snapshot = load_snapshot(snapshot_path(self.path), self.path, self.cache_key[3])
+        if snapshot is not None:
+            library = PromptLibrary(snapshot[0], snapshot[1])
+        else:
+            library = PromptLibrary(self.parse())
+            if self.auto_compile:
+                self.compile(library)
+        library.mount(os.path.dirname(self.path))
+        return library
+
+    def cache_size(self) -> int:
+        # SQLiteはページキャッシュ分だけメモリに載る
+        return 0 if self.file_type in SQLITE_EXTS else self.cache_key[1]
+
+    def load_library(self) -> PromptLibrary:
+        # 同じファイルを指す全PromptFileで共有されるので変更しないこと
+        library = prompt_dict_cache.get_or_create(
+            self.cache_key, lambda: (self.load_compiled(), self.cache_size())
+        )
+        if library.is_stale():
+            prompt_dict_cache.remove(self.cache_key)
+            library = prompt_dict_cache.get_or_create(
+                self.cache_key, lambda: (self.load_compiled(), self.cache_size())
+            )
+        return library
+
+    def load_shared(self) -> PromptDict:
+        return self.load_library().prompt_dict
+
+    def load(self) -> PromptDict:
+        return copy.deepcopy(self.load_shared())
 
 
 def remove_comment_out(s: str) -> str:
-    return re.sub(r"((//|#).+$|/\*[\s\S]*?\*/)", "", s, flags=re.MULTILINE)
+    return COMMENT_PATTERN.sub("", s)
 
 
 def select_dynamic_prompt(rand: Random, s: str) -> str:
-    return re.sub(
-        r"{([^}]+)}",
-        lambda m: rand.choices(m.group(1).split("|"), weights=None)[0],
-        s,
-        flags=re.MULTILINE,
+    return CHOICE_PATTERN.sub(
+        lambda m: rand.choices(m.group(1).split("|"), weights=None)[0], s
     )
 
 
+def pick_prompt_value(
+    rand: Random,
+    d: PromptDict | list[str] | WildcardFile | str | int | float | bool,
+) -> Any:
+    if isinstance(d, dict):
+        return d.get("_t", "")
+    elif isinstance(d, (list, WildcardFile)):
+        return rand.choices(d)[0]
+    else:
+        return str(d)
+
+
 def expand_prompt_var(
     rand: Random,
-    d: PromptDict | list[str] | str | int | float | bool,
+    d: PromptDict | list[str] | WildcardFile | str | int | float | bool,
     prefix: list[str],
 ) -> str:
-    if isinstance(d, dict):
-        value = d.get("_t", "")
-    elif isinstance(d, list):
-        value = rand.choices(d)[0]
-    else:
-        value = str(d)
-
-    def to_tag(m: re.Match[str]) -> str:
-        var_name = m.group(1)
-        var_type = "var" if var_name[0] == "$" else "tag"
-        var_name = var_name[1:]
-        if var_name.startswith("::"):
-            r = ".".join([var_name[2:]])
-        else:
-            r = ".".join(prefix + [var_name])
-        return f"<{var_type}>{r}</{var_type}>"
-
-    while re.search(r"([$%]:*[a-zA-Z_.*?]+)", cast(str, value)):
-        value = re.sub(
-            r"([$%]:*[a-zA-Z_.*?]+)",
-            to_tag,
-            cast(str, value),
-            flags=re.MULTILINE,
-        )
-    return cast(str, value)
+    return expand_var_refs(cast(str, pick_prompt_value(rand, d)), prefix)
+
+
+def load_lines_from_file(path: str) -> WildcardFile:
+    st = os.stat(path)
+    key = (os.path.realpath(path), st.st_size, st.st_mtime_ns)
+
+    def load() -> tuple[WildcardFile, int]:
+        r = WildcardFile(path)
+        return (r, r.nbytes())
+
+    return wildcard_cache.get_or_create(key, load)
 
 
 def load_prompt_var(
     d: PromptDict, keys: list[str], root_dir: str
-) -> tuple[PromptDict, list[str] | str]:
+) -> tuple[PromptDict, list[str] | WildcardFile | str]:
     for key in keys[:-1]:
         d = cast(PromptDict, d[key])
     var_name = keys[-1]
 
     if isinstance(d[var_name], dict) and "_load_from_file" in d[var_name]:
-        with open(
-            os.path.join(
-                root_dir,
-                cast(dict[str, Any], d[var_name])["_load_from_file"],
+        return (
+            d,
+            load_lines_from_file(
+                os.path.join(
+                    root_dir,
+                    cast(dict[str, Any], d[var_name])["_load_from_file"],
+                )
             ),
-            "r",
-            encoding="utf-8",
-        ) as f:
-            r: list[str] = []
-            for line in f.readlines():
-                line = line.strip()
-                if not line.startswith("#") and not line.startswith("//"):
-                    r += [line]
-            d[var_name] = r
-        return (d, cast(list[str], d[var_name]))
+        )
 
     if isinstance(d[var_name], list):
         return (d, [str(v) for v in cast(list[Any], d[var_name])])
@@ -107,32 +247,25 @@ def load_prompt_var(
 def get_keys_all(
     d: PromptDict,
     rand: Random | None = None,
-    loaded_keys: list[str] | None = None,
+    loaded_keys: KeyList | None = None,
+    index: NodeIndex | None = None,
 ) -> list[tuple[int, str]]:
-    def when(key: str):
-        if loaded_keys is None:
-            return True
-        if not isinstance(d[key], dict):
-            return True
-        target = cast(PromptDict, d[key])
-        return ("_when" not in target or target["_when"] in loaded_keys) and (
-            "_when_not" not in target or target["_when_not"] not in loaded_keys
+    if index is None:
+        index = NodeIndex()
+    meta = index.get(d)
+    keys = meta.filter_keys(d, loaded_keys)
+
+    if rand and meta.r is not None:
+        inclusion = index.get_inclusion(
+            d, keys, loaded_keys is None or meta.is_static(d)
         )
-
-    if "_k" in d:
-        keys = [(i, str(k)) for i, k in enumerate(d["_k"]) if k in d and when(k)]
-    else:
-        keys = [
-            (i, k)
-            for i, k in enumerate([k for k in d.keys() if not k.startswith("_")])
-            if when(k)
-        ]
-
-    if rand and "_r" in d:
+        if inclusion is not None:
+            return inclusion.choose(rand, keys)
+        # 不正な_rは従来通りrand.choicesで例外にする
         indices = [i for i, _ in keys]
-        weights = cast(list[float], d["_r"])
+        weights = cast(list[float], meta.r)
         if len(weights) < len(indices):
-            weights += [1.0 for _ in range(len(indices) - len(weights))]
+            weights = weights + [1.0 for _ in range(len(indices) - len(weights))]
         return [
             (i, key)
             for i, key in keys
@@ -152,13 +285,15 @@ def get_keys_term(
     d: PromptDict,
     term: bool,
     rand: Random | None = None,
-    loaded_keys: list[str] | None = None,
+    loaded_keys: KeyList | None = None,
+    index: NodeIndex | None = None,
 ):
+    if index is None:
+        index = NodeIndex()
     return [
         (i, k)
-        for i, k in get_keys_all(d, rand=rand, loaded_keys=loaded_keys)
-        if (isinstance(d[k], str) or len(get_keys_all(cast(PromptDict, d[k]))) == 0)
-        == term
+        for i, k in get_keys_all(d, rand=rand, loaded_keys=loaded_keys, index=index)
+        if index.is_term(d[k]) == term
     ]
 
 
@@ -166,46 +301,70 @@ def get_keys_all_recursive(
     d: PromptDict,
     prefix: list[str] | None = None,
     rand: Random | None = None,
-    loaded_keys: list[str] | None = None,
+    loaded_keys: KeyList | None = None,
+    index: NodeIndex | None = None,
 ) -> tuple[list[str], list[str]]:
     if prefix is None:
         prefix = []
+    if index is None:
+        index = NodeIndex()
     r_long: list[str] = []
     r_short: list[str] = []
-    for _, k in get_keys_all(d, rand=rand, loaded_keys=loaded_keys):
+    for _, k in get_keys_all(d, rand=rand, loaded_keys=loaded_keys, index=index):
         v = d[k]
         if isinstance(v, str):
             r_long += [".".join(prefix + [k])]
-        elif len(get_keys_all(cast(PromptDict, v))) == 0:
-            if "_t" in v:
+        elif index.is_term(v):
+            if index.get(v).has_t:
                 r_long += [".".join(prefix + [k])]
         else:
-            if "_t" in v:
+            if index.get(v).has_t:
                 r_short += [".".join(prefix + [k])]
             l, s = get_keys_all_recursive(
                 cast(PromptDict, v),
                 prefix + [k],
                 rand=rand,
                 loaded_keys=loaded_keys,
+                index=index,
             )
             r_long += l
             r_short += s
     return (r_long, r_short)
 
 
+def find_keys(d: PromptDict, sub: str, index: NodeIndex | None = None) -> list[str]:
+    if index is None:
+        index = NodeIndex()
+
+    def build() -> list[str]:
+        r_long, r_short = get_keys_all_recursive(d, index=index)
+        return r_long + r_short
+
+    return index.find_keys(d, sub, build)
+
+
 def get_keys_random(
     rand: Random,
     d: PromptDict,
     branch_term: bool = False,
-    loaded_keys: list[str] | None = None,
+    loaded_keys: KeyList | None = None,
+    index: NodeIndex | None = None,
 ):
-    ikeys = get_keys_term(d, branch_term, loaded_keys=loaded_keys)
+    if index is None:
+        index = NodeIndex()
+    sampler = index.get_sampler(d, branch_term, loaded_keys)
+    if sampler is not None:
+        return sampler.choose(rand)
+
+    # 選択できない場合は従来通りrand.choicesで例外にする
+    ikeys = get_keys_term(d, branch_term, loaded_keys=loaded_keys, index=index)
     indices = [i for i, _ in ikeys]
+    indices_set = set(indices)
     if "_w" in d:
         try:
             i = rand.choices(
                 indices,
-                [float(v) for i, v in enumerate(d["_w"]) if i in indices],
+                [float(v) for i, v in enumerate(d["_w"]) if i in indices_set],
             )[0]
         except:
             raise Exception(f"Invalid weights: keys={ikeys}, weights={d["_w"]}")
@@ -217,24 +376,33 @@ def get_keys_random(
 def get_keys_random_recursive(
     rand: Random,
     input_dict: PromptDict,
-    loaded_keys: list[str] | None = None,
+    loaded_keys: KeyList | None = None,
+    index: NodeIndex | None = None,
 ):
+    if index is None:
+        index = NodeIndex()
     r: list[str] = []
     prefix: list[str] = []
-    d = input_dict
+    d: PromptDict | Any = input_dict
     while isinstance(d, dict):
-        ikeys = get_keys_all(d, loaded_keys=loaded_keys)
-        indices = [i for i, _ in ikeys]
-        if len(ikeys) == 0:
-            break
-
-        weights = (
-            None
-            if d.get("_w", None) is None
-            else [float(v) for i, v in enumerate(d["_w"]) if i in indices]
-        )
-        i = rand.choices(indices, weights=weights)[0]
-        key = ikeys[indices.index(i)][1]
+        d = cast(PromptDict, d)
+        sampler = index.get_sampler(d, None, loaded_keys)
+        if sampler is not None:
+            key = sampler.choose(rand)
+        else:
+            ikeys = get_keys_all(d, loaded_keys=loaded_keys, index=index)
+            indices = [i for i, _ in ikeys]
+            indices_set = set(indices)
+            if len(ikeys) == 0:
+                break
+
+            weights = (
+                None
+                if d.get("_w", None) is None
+                else [float(v) for i, v in enumerate(d["_w"]) if i in indices_set]
+            )
+            i = rand.choices(indices, weights=weights)[0]
+            key = ikeys[indices.index(i)][1]
         d = d[key]
         if isinstance(d, str) or "_t" in d:
             r += [".".join(prefix + [key])]
@@ -242,29 +410,62 @@ def get_keys_random_recursive(
     return r
 
 
-def build_search_keys(
-    keys: str | list[list[str]], prefix: list[str] | None = None
-) -> list[str]:
+# 1つのキー名から展開する検索キー数の上限
+MAX_SEARCH_KEYS = 65536
+
+SPECIAL_SEARCH_KEYS = ["?", "*", "??", "**"]
+SPECIAL_WALK_KEYS = SPECIAL_SEARCH_KEYS + ["?$", "*$"]
+
+
+def iter_search_keys(
+    keys: str | list[list[str]],
+    prompt_dict: PromptDict | None = None,
+    prefix: list[str] | None = None,
+    max_keys: int | None = None,
+) -> Iterator[str]:
     if prefix is None:
         prefix = []
+    if max_keys is None:
+        max_keys = MAX_SEARCH_KEYS
     if isinstance(keys, str):
         keys = [(key.split("+")) for key in keys.split(".")]
-    key_len = len(keys)
-    if key_len == 1:
-        # 終端の*, ?を区別できるように変換
-        return [
-            ".".join(prefix + [key + "$" if key in ["?", "*"] else key])
-            for key in keys[0]
-        ]
-    elif key_len == 0:
-        return []
-    return functools.reduce(
-        lambda x, y: x + y,
-        [
-            [".".join(prefix + [key])] + build_search_keys(keys[1:], prefix + [key])
-            for key in keys[0]
-        ],
-    )
+    parts = keys
+    count = 0
+
+    def child(d: Any, key: str, prunable: bool) -> tuple[Any, bool] | None:
+        # 辞書に存在しない接頭辞の下は展開しない
+        # _random_countを持つノードは通るたびに乱数を進めるので、その下は展開を省略しない
+        if d is None or key in SPECIAL_SEARCH_KEYS or key.endswith("()"):
+            return (None, False)
+        if isinstance(d, dict) and key in d:
+            v: Any = cast(PromptDict, d)[key]
+            random_count = isinstance(v, dict) and "_random_count" in v
+            return (cast(Any, v), prunable and not random_count)
+        return None if prunable else (None, False)
+
+    def expand(depth: int, path: list[str], d: Any, prunable: bool) -> Iterator[str]:
+        nonlocal count
+        for key in parts[depth]:
+            count += 1
+            if count > max_keys:
+                raise Exception(f"Too many search keys: > {max_keys}")
+            if depth == len(parts) - 1:
+                # 終端の*, ?を区別できるように変換
+                yield ".".join(path + [key + "$" if key in ["?", "*"] else key])
+                continue
+            yield ".".join(path + [key])
+            r = child(d, key, prunable)
+            if r is not None:
+                yield from expand(depth + 1, path + [key], r[0], r[1])
+
+    if len(parts) > 0:
+        yield from expand(0, prefix, prompt_dict, prompt_dict is not None)
+
+
+def build_search_keys(
+    keys: str | list[list[str]], prefix: list[str] | None = None
+) -> list[str]:
+    return list(iter_search_keys(keys, prefix=prefix))
 
 
 def exists_in_prompt_dict(prompt_dict: PromptDict, key: str):
@@ -277,12 +478,13 @@ def exists_in_prompt_dict(prompt_dict: PromptDict, key: str):
 
 
 def export_values(
-    d: PromptDict, exports: dict[str, str], prefix: str, exclude_keys: list[str]
+    d: PromptDict, exports: dict[str, str], prefix: str, exclude_keys: KeyList
 ):
     if "_exports" in d:
         for k, v in cast(dict[str, Any], d["_exports"]).items():
             if exports.get(k, None) != v and prefix not in exclude_keys:
-                print("Export:", k, "=", v)
+                if tracer.enabled:
+                    tracer.emit("export", key=k, value=v)
                 exports[k] = v
 
 
@@ -300,17 +502,18 @@ def get_post_keys(post_keys: list[str], prefix: str):
 def collect_prompt(
     rand: Random,
     prompt_dict: PromptDict,
-    keys: str | list[str] | list[list[str]],
-    exclude_keys: list[str] | None = None,
+    keys: str | Iterable[str] | list[list[str]],
+    exclude_keys: KeyList | None = None,
     init_prefix: list[str] | None = None,
     root_dict: PromptDict | None = None,
     parent_dict: PromptDict | None = None,
     exports: dict[str, str] = {},
     root_dir: str | None = None,
     post_keys: list[str] | None = None,
+    index: NodeIndex | None = None,
 ) -> list[str]:
     if exclude_keys is None:
-        exclude_keys = []
+        exclude_keys = LoadedKeys()
     if root_dict is None:
         root_dict = prompt_dict
     if parent_dict is None:
@@ -321,30 +524,73 @@ def collect_prompt(
         init_prefix = []
     if post_keys is None:
         post_keys = []
+    if index is None:
+        index = NodeIndex()
 
     if isinstance(keys, str):
-        keys = build_search_keys(keys)
+        keys = iter_search_keys(keys, prompt_dict)
+
+    def has_effects(d: Any) -> bool:
+        # _exports, _post, _random_countのないノードは辿っても何もしない
+        return not isinstance(d, dict) or index.get(cast(PromptDict, d)).has_effects
+
+    # visitからは書き換えずに追加するだけなので、Noneを除いた型で参照する
+    loaded: KeyList = exclude_keys
+    posts: list[str] = post_keys
+
+    def visit(d: Any, prefix: list[str]):
+        export_values(d, exports, ".".join(prefix), loaded)
+        if isinstance(d, dict):
+            # _postを処理
+            key = ".".join(prefix)
+            post = index.get(cast(PromptDict, d)).post
+            if post is not None and f"{key}._post" not in loaded:
+                order = cast(PromptDict, d).get("_post_order", "last")
+                if order == "last":
+                    posts.extend(get_post_keys(post, key))
+                else:
+                    order = int(cast(str | int, order))
+                    for k in get_post_keys(post, key):
+                        posts.insert(order, k)
+                loaded.append(f"{key}._post")
+            # _random_countを処理
+            if "_random_count" in d:
+                rand.set_count(int(cast(int, d["_random_count"])))
 
     init_parent_dict = parent_dict
     r: list[str] = []
+    # 直前に辿ったパス (キー, 親, ノード, 辿った時の処理があるか)
+    # 検索キーは接頭辞を共有するので共通部分は辿り直さずノードの処理だけ繰り返す
+    walked: list[tuple[str, PromptDict, Any, bool]] = []
     for key in keys:
         d = prompt_dict
         parent_dict = init_parent_dict
         key_parts = key.split(".") if isinstance(key, str) else key
         prefix = init_prefix[:]
+        # walkedと一致している深さ ?や*を辿った後は-1
+        depth = 0
         while len(key_parts) > 0:
             key = key_parts.pop(0)
+            if 0 <= depth < len(walked) and walked[depth][0] == key:
+                _, parent_dict, d, effects = walked[depth]
+                depth += 1
+                prefix += [key]
+                if effects:
+                    visit(d, prefix)
+                continue
+            plain = key not in SPECIAL_WALK_KEYS and not key.endswith("()")
             if key in ["?", "?$"]:
                 key = get_keys_random(
                     rand,
                     cast(Any, d),
                     key.endswith("$"),
                     loaded_keys=exclude_keys,
+                    index=index,
                 )
             elif key == "??":
                 assert len(key_parts) == 0
                 pick_keys = get_keys_random_recursive(
-                    rand, cast(PromptDict, d), loaded_keys=exclude_keys
+                    rand, cast(PromptDict, d), loaded_keys=exclude_keys, index=index
                 )
                 r += collect_prompt(
                     rand,
@@ -357,6 +603,7 @@ def collect_prompt(
                     exports=exports,
                     root_dir=root_dir,
                     post_keys=post_keys,
+                    index=index,
                 )
                 break
             elif key in ["*", "*$"]:
@@ -365,6 +612,7 @@ def collect_prompt(
                     key.endswith("$"),
                     rand=rand,
                     loaded_keys=exclude_keys,
+                    index=index,
                 )
                 pick_keys = [
                     ".".join([key] + key_parts) for _, key in pick_key_and_indices
@@ -380,12 +628,16 @@ def collect_prompt(
                     exports=exports,
                     root_dir=root_dir,
                     post_keys=post_keys,
+                    index=index,
                 )
                 break
             elif key == "**":
                 assert len(key_parts) == 0
                 pick_keys = get_keys_all_recursive(
-                    cast(PromptDict, d), rand=rand, loaded_keys=exclude_keys
+                    cast(PromptDict, d),
+                    rand=rand,
+                    loaded_keys=exclude_keys,
+                    index=index,
                 )
                 r += collect_prompt(
                     rand,
@@ -398,6 +650,7 @@ def collect_prompt(
                     exports=exports,
                     root_dir=root_dir,
                     post_keys=post_keys,
+                    index=index,
                 )
                 break
             elif key.endswith("()"):
@@ -411,41 +664,42 @@ def collect_prompt(
                 parent_dict = cast(PromptDict, d)
                 d = cast(Any, d[key])
                 prefix += [key]
+                effects = has_effects(d)
+                if plain and depth >= 0:
+                    del walked[depth:]
+                    walked += [(key, parent_dict, d, effects)]
+                    depth += 1
+                else:
+                    depth = -1
 
-                export_values(d, exports, ".".join(prefix), exclude_keys)
-                if isinstance(d, dict):
-                    # _postを処理
-                    key = ".".join(prefix)
-                    if "_post" in d and f"{key}._post" not in exclude_keys:
-                        order = cast(PromptDict, d).get("_post_order", "last")
-                        if order == "last":
-                            post_keys += get_post_keys(cast(list[str], d["_post"]), key)
-                        else:
-                            order = int(cast(str | int, order))
-                            for k in get_post_keys(cast(list[str], d["_post"]), key):
-                                post_keys.insert(order, k)
-                        exclude_keys += [f"{key}._post"]
-                    # _random_countを処理
-                    if "_random_count" in d:
-                        rand.set_count(int(cast(int, d["_random_count"])))
+                if effects:
+                    visit(d, prefix)
         else:
             # breakされてないならプロンプトを追加
             prefix_str = ".".join(prefix)
-            is_term = isinstance(d, (str, list)) or len(get_keys_all(cast(Any, d))) == 0
+            is_term = isinstance(d, (str, list)) or index.is_term(d)
             is_dict = isinstance(d, dict)
-            _, d = load_prompt_var(prompt_dict, prefix[len(init_prefix) :], root_dir)
+            # 親ノードは辿り済みなので最後のキーだけ読み込む
+            _, d = load_prompt_var(
+                parent_dict, prefix[len(init_prefix) :][-1:], root_dir
+            )
             if prefix_str not in exclude_keys or is_term:
-                prompt = select_dynamic_prompt(
-                    rand,
-                    remove_comment_out(
-                        expand_prompt_var(rand, d, prefix if is_dict else prefix[:-1])
-                    ),
-                )
+                value = pick_prompt_value(rand, d)
+                var_prefix = prefix if is_dict else prefix[:-1]
+                if isinstance(value, str):
+                    prompt = index.templates.get(value, var_prefix).render(rand)
+                else:
+                    prompt = select_dynamic_prompt(
+                        rand,
+                        remove_comment_out(expand_var_refs(value, var_prefix)),
+                    )
                 if prompt:
                     r += [prompt]
                 if prefix_str in exclude_keys:
-                    print(f"Load Prompt (Duplicated): {prefix_str}")
+                    if tracer.enabled:
+                        tracer.emit("load", key=prefix_str, duplicated=True)
                 else:
                     exclude_keys += [prefix_str]
-                    print(f"Load Prompt: {prefix_str}")
+                    if tracer.enabled:
+                        tracer.emit("load", key=prefix_str, duplicated=False)
     return r
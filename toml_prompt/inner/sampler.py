@@ -0,0 +1,114 @@
+from typing import Any
+
+import math
+import bisect
+
+from .util import Random
+
+# cumulative: random.choicesと同じ乱数消費・結果 (既存のシードを再現する)
+# alias: Walkerのエイリアス法 O(1)で選ぶが結果はcumulativeと異なる
+SAMPLERS = ("cumulative", "alias")
+SAMPLER_KEY = "_sampler"
+
+
+# _k/_wによるキーの重み付き選択
+class KeySampler:
+    def __init__(self, keys: list[str], cum_weights: list[float] | None):
+        self.keys = keys
+        self.n = float(len(keys))
+        self.cum_weights = cum_weights
+        self.total = 0.0 if cum_weights is None else cum_weights[-1] + 0.0
+        self.hi = len(keys) - 1
+
+    def choose(self, rand: Random) -> str:
+        if self.cum_weights is None:
+            return self.keys[math.floor(rand.random() * self.n)]
+        return self.keys[
+            bisect.bisect(self.cum_weights, rand.random() * self.total, 0, self.hi)
+        ]
+
+
+class AliasSampler(KeySampler):
+    def __init__(self, keys: list[str], weights: list[float]):
+        super().__init__(keys, None)
+        n = len(weights)
+        total = math.fsum(weights)
+        scaled = [w * n / total for w in weights]
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            if scaled[l] < 1.0:
+                small += [l]
+            else:
+                large += [l]
+
+    def choose(self, rand: Random) -> str:
+        u = rand.random() * self.n
+        i = min(int(u), self.hi)
+        return self.keys[i if u - i < self.prob[i] else self.alias[i]]
+
+
+def build_key_sampler(
+    keys: list[tuple[int, str]], w: list[Any] | None, mode: str
+) -> KeySampler | None:
+    # random.choicesが例外になる入力はNoneを返して従来の処理に任せる
+    if len(keys) == 0:
+        return None
+    if w is None:
+        return KeySampler([k for _, k in keys], None)
+    indices = set(i for i, _ in keys)
+    try:
+        weights = [float(v) for i, v in enumerate(w) if i in indices]
+    except (TypeError, ValueError):
+        return None
+    if len(weights) != len(keys):
+        return None
+    cum_weights: list[float] = []
+    total = 0.0
+    for v in weights:
+        total = v if not cum_weights else total + v
+        cum_weights += [total]
+    if total + 0.0 <= 0.0 or not math.isfinite(total):
+        return None
+    if mode == "alias" and all(v >= 0.0 for v in weights):
+        return AliasSampler([k for _, k in keys], weights)
+    return KeySampler([k for _, k in keys], cum_weights)
+
+
+# _rによる各キーの独立した選択
+# rand.choices([True, False], [w, 1.0 - w])と同じ乱数消費・結果
+class InclusionSampler:
+    def __init__(self, thresholds: list[tuple[Any, float]]):
+        self.thresholds = thresholds
+
+    def choose(
+        self, rand: Random, keys: list[tuple[int, str]]
+    ) -> list[tuple[int, str]]:
+        return [
+            ik
+            for ik, (w, total) in zip(keys, self.thresholds)
+            if rand.random() * total < w
+        ]
+
+
+def build_inclusion_sampler(
+    keys: list[tuple[int, str]], r: list[Any]
+) -> InclusionSampler | None:
+    weights = r + [1.0 for _ in range(len(keys) - len(r))]
+    thresholds: list[tuple[Any, float]] = []
+    try:
+        for _, w in zip(keys, weights):
+            total = (w + (1.0 - w)) + 0.0
+            if total <= 0.0 or not math.isfinite(total):
+                return None
+            thresholds += [(w, total)]
+    except TypeError:
+        return None
+    return InclusionSampler(thresholds)
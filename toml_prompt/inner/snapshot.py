@@ -0,0 +1,95 @@
+from typing import Any, cast
+
+import os
+import sys
+import struct
+import marshal
+import argparse
+
+SNAPSHOT_MAGIC = b"TPSNAP"
+SNAPSHOT_VERSION = 2
+SNAPSHOT_EXT = ".tpc"
+
+# magic, スナップショット形式のバージョン, marshal形式のバージョン, ソースのsha256
+HEADER = struct.Struct(f"<{len(SNAPSHOT_MAGIC)}sHH32s")
+
+
+def snapshot_path(path: str) -> str:
+    return path + SNAPSHOT_EXT
+
+
+def dump_snapshot(
+    path: str, source_sha256: str, prompt_dict: Any, indexes: dict[str, Any]
+) -> bool:
+    try:
+        payload = marshal.dumps({"prompt": prompt_dict, "indexes": indexes})
+    except ValueError:
+        # datetimeなどmarshalで扱えない値を含む
+        return False
+    header = HEADER.pack(
+        SNAPSHOT_MAGIC,
+        SNAPSHOT_VERSION,
+        marshal.version,
+        bytes.fromhex(source_sha256),
+    )
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            f.write(payload)
+        os.replace(tmp_path, path)
+    except OSError:
+        return False
+    return True
+
+
+def load_snapshot(
+    path: str, source_path: str, source_sha256: str
+) -> tuple[Any, dict[str, Any]] | None:
+    try:
+        if os.stat(path).st_mtime_ns < os.stat(source_path).st_mtime_ns:
+            return None
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) < HEADER.size:
+        return None
+    magic, version, marshal_version, sha256 = HEADER.unpack_from(data)
+    if (
+        magic != SNAPSHOT_MAGIC
+        or version != SNAPSHOT_VERSION
+        or marshal_version != marshal.version
+        or sha256 != bytes.fromhex(source_sha256)
+    ):
+        return None
+    try:
+        r = cast(dict[str, Any], marshal.loads(data[HEADER.size :]))
+    except (EOFError, ValueError, TypeError):
+        return None
+    return (r["prompt"], r["indexes"])
+
+
+def main(argv: list[str] | None = None):
+    from .prompt import PromptFile
+
+    parser = argparse.ArgumentParser(
+        prog="python -m toml_prompt.inner.snapshot",
+        description="Compile prompt files into binary snapshots.",
+    )
+    parser.add_argument("files", nargs="+", help="TOML/YAML prompt files.")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for path in cast(list[str], args.files):
+        prompt = PromptFile(path)
+        if prompt.compile():
+            print(f"Compiled: {path} -> {snapshot_path(path)}")
+        else:
+            print(f"Failed: {path}", file=sys.stderr)
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+from typing import Any, Iterator, cast
+
+import os
+import sys
+import copy
+import json
+import sqlite3
+import argparse
+import threading
+import urllib.request
+
+from .cache import LRUCache
+from .mount import MOUNT_KEY
+
+SQLITE_EXTS = (".sqlite", ".sqlite3", ".db")
+SCHEMA_VERSION = 1
+
+# 配列・テキストとして専用カラムに持つキー
+NODE_COLUMNS = {"_t": "t", "_k": "k", "_w": "w", "_r": "r"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS node (
+    id INTEGER PRIMARY KEY,
+    t TEXT,
+    k TEXT,
+    w TEXT,
+    r TEXT,
+    meta TEXT
+);
+CREATE TABLE IF NOT EXISTS child (
+    parent INTEGER NOT NULL,
+    pos INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    node INTEGER,
+    value TEXT,
+    PRIMARY KEY (parent, pos)
+);
+CREATE INDEX IF NOT EXISTS child_key ON child (parent, key);
+"""
+
+
+def dump_value(v: Any) -> str:
+    return json.dumps(v, ensure_ascii=False, default=str)
+
+
+# SQLiteに保存されたノードへの参照
+# 内容はSqlitePromptStoreのページキャッシュから都度取得するので木全体をメモリに持たない
+class SqliteDict(dict[str, Any]):
+    def __init__(self, store: "SqlitePromptStore", node_id: int):
+        super().__init__()
+        self.store = store
+        self.node_id = node_id
+
+    def content(self) -> dict[str, Any]:
+        return self.store.load_node(self.node_id)
+
+    def __getitem__(self, key: str) -> Any:
+        return self.content()[key]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.content()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.content())
+
+    def __len__(self) -> int:
+        return len(self.content())
+
+    def __eq__(self, other: object) -> bool:
+        return self.content() == other
+
+    __hash__ = None  # type: ignore
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.content().get(key, default)
+
+    def keys(self):
+        return self.content().keys()
+
+    def values(self):
+        return self.content().values()
+
+    def items(self):
+        return self.content().items()
+
+    def __deepcopy__(self, memo: dict[int, Any]) -> dict[str, Any]:
+        return copy.deepcopy(dict(self.items()), memo)
+
+    def __repr__(self) -> str:
+        return f"SqliteDict({self.node_id})"
+
+
+class SqlitePromptStore:
+    def __init__(self, path: str, cache_entries: int = 4096):
+        self.path = path
+        self.local = threading.local()
+        # ページキャッシュ: ノードID -> 子ノードを参照に置き換えた辞書
+        self.pages = LRUCache(max_bytes=1 << 62, max_entries=cache_entries)
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                f"file:{urllib.request.pathname2url(self.path)}?mode=ro", uri=True
+            )
+            try:
+                self.check_schema(conn)
+            except Exception:
+                conn.close()
+                raise
+            self.local.conn = conn
+        return conn
+
+    def check_schema(self, conn: sqlite3.Connection):
+        # 異なるレイアウトのデータベースは読み込まずに失敗させる
+        try:
+            rows = conn.execute(
+                "SELECT value FROM info WHERE key = 'schema_version'"
+            ).fetchall()
+        except sqlite3.DatabaseError:
+            rows = []
+        version = rows[0][0] if rows else None
+        if version != str(SCHEMA_VERSION):
+            raise Exception(
+                f"Unsupported SQLite prompt library: {self.path} "
+                f"(schema_version={version}, expected {SCHEMA_VERSION})"
+            )
+
+    def root(self) -> SqliteDict:
+        return SqliteDict(self, 0)
+
+    def load_indexes(self) -> dict[str, Any]:
+        rows = (
+            self.connection()
+            .execute("SELECT value FROM info WHERE key = 'indexes'")
+            .fetchall()
+        )
+        return cast(dict[str, Any], json.loads(rows[0][0])) if rows else {}
+
+    def read_node(self, node_id: int) -> dict[str, Any]:
+        conn = self.connection()
+        row = conn.execute(
+            "SELECT t, k, w, r, meta FROM node WHERE id = ?", (node_id,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(f"Node not found: {node_id}")
+        r: dict[str, Any] = {}
+        for key, v in zip(NODE_COLUMNS.keys(), row[:4]):
+            if v is not None:
+                r[key] = json.loads(v)
+        if row[4] is not None:
+            r.update(json.loads(row[4]))
+        for key, child_id, value in conn.execute(
+            "SELECT key, node, value FROM child WHERE parent = ? ORDER BY pos",
+            (node_id,),
+        ):
+            if child_id is not None:
+                r[key] = SqliteDict(self, child_id)
+            else:
+                r[key] = json.loads(value)
+        return r
+
+    def load_node(self, node_id: int) -> dict[str, Any]:
+        return self.pages.get_or_create(node_id, lambda: (self.read_node(node_id), 1))
+
+
+def import_prompt_dict(d: dict[str, Any], db_path: str, indexes: dict[str, Any]):
+    tmp_path = f"{db_path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(SCHEMA)
+        next_id = 1
+        stack: list[tuple[int, dict[str, Any]]] = [(0, d)]
+        while stack:
+            node_id, v = stack.pop()
+            columns: dict[str, str] = {}
+            meta: dict[str, Any] = {}
+            children: list[tuple[int, str, int | None, str | None]] = []
+            for key, child in v.items():
+                if key in NODE_COLUMNS and not isinstance(child, dict):
+                    columns[NODE_COLUMNS[key]] = dump_value(child)
+                elif key.startswith("_") and not isinstance(child, dict):
+                    meta[key] = child
+                elif isinstance(child, dict):
+                    children += [(len(children), key, next_id, None)]
+                    stack += [(next_id, cast(dict[str, Any], child))]
+                    next_id += 1
+                else:
+                    children += [(len(children), key, None, dump_value(child))]
+            conn.execute(
+                "INSERT INTO node (id, t, k, w, r, meta) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    node_id,
+                    columns.get("t", None),
+                    columns.get("k", None),
+                    columns.get("w", None),
+                    columns.get("r", None),
+                    dump_value(meta) if meta else None,
+                ),
+            )
+            conn.executemany(
+                "INSERT INTO child (parent, pos, key, node, value) VALUES (?, ?, ?, ?, ?)",
+                [(node_id, pos, k, n, val) for pos, k, n, val in children],
+            )
+        conn.executemany(
+            "INSERT INTO info (key, value) VALUES (?, ?)",
+            [
+                ("schema_version", str(SCHEMA_VERSION)),
+                ("indexes", dump_value(indexes)),
+            ],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, db_path)
+
+
+def import_prompt_file(src_path: str, db_path: str):
+    from .prompt import PromptFile, PromptLibrary
+
+    # _includeは全て読み込んで1つのデータベースにまとめる
+    d = copy.deepcopy(PromptFile(src_path).load_shared())
+    stack: list[dict[str, Any]] = [d]
+    while stack:
+        v = stack.pop()
+        v.pop(MOUNT_KEY, None)
+        stack += [cast(dict[str, Any], c) for c in v.values() if isinstance(c, dict)]
+    library = PromptLibrary(d)
+    library.build_indexes()
+    import_prompt_dict(library.prompt_dict, db_path, library.indexes)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m toml_prompt.inner.sqlite_store",
+        description="Import a TOML/YAML prompt file into a SQLite prompt library.",
+    )
+    parser.add_argument("src", help="TOML/YAML prompt file.")
+    parser.add_argument("dst", help="Output SQLite file.")
+    args = parser.parse_args(argv)
+    import_prompt_file(cast(str, args.src), cast(str, args.dst))
+    print(f"Imported: {args.src} -> {args.dst}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
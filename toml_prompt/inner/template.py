@@ -0,0 +1,102 @@
+from typing import cast
+
+import re
+
+from .cache import LRUCache
+from .util import Random
+
+VAR_PATTERN = re.compile(r"([$%]:*[a-zA-Z_.*?]+)", flags=re.MULTILINE)
+COMMENT_PATTERN = re.compile(r"((//|#).+$|/\*[\s\S]*?\*/)", flags=re.MULTILINE)
+CHOICE_PATTERN = re.compile(r"{([^}]+)}", flags=re.MULTILINE)
+REF_PATTERN = re.compile(r"<(var|tag)>([^<]*)</\1>")
+
+# ("text", 文字列) ("var", キー) ("tag", キー) ("choice", 選択肢)
+type Token = tuple[str, str | list[str]]
+
+
+def expand_var_refs(value: str, prefix: list[str]) -> str:
+    def to_tag(m: re.Match[str]) -> str:
+        var_name = m.group(1)
+        var_type = "var" if var_name[0] == "$" else "tag"
+        var_name = var_name[1:]
+        if var_name.startswith("::"):
+            r = ".".join([var_name[2:]])
+        else:
+            r = ".".join(prefix + [var_name])
+        return f"<{var_type}>{r}</{var_type}>"
+
+    while VAR_PATTERN.search(value):
+        value = VAR_PATTERN.sub(to_tag, value)
+    return value
+
+
+def tokenize_text(s: str) -> list[Token]:
+    r: list[Token] = []
+    pos = 0
+    for m in REF_PATTERN.finditer(s):
+        if m.start() > pos:
+            r += [("text", s[pos : m.start()])]
+        r += [(m.group(1), m.group(2))]
+        pos = m.end()
+    if pos < len(s):
+        r += [("text", s[pos:])]
+    return r
+
+
+# $var/%tagの展開とコメントの削除を済ませ、{a|b}の選択だけを実行時に行うテンプレート
+class Template:
+    __slots__ = ("tokens", "parts", "text")
+
+    def __init__(self, tokens: list[Token]):
+        self.tokens = tokens
+        # 選択肢以外の連続するトークンは1つの文字列にまとめる
+        self.parts: list[str | list[str]] = []
+        buf: list[str] = []
+        has_choice = False
+        for kind, v in tokens:
+            if kind == "choice":
+                if buf:
+                    self.parts += ["".join(buf)]
+                    buf = []
+                self.parts += [v]
+                has_choice = True
+                continue
+            s = cast(str, v)
+            buf += [s if kind == "text" else f"<{kind}>{s}</{kind}>"]
+        if buf:
+            self.parts += ["".join(buf)]
+        # 選択肢がなければ常に同じ文字列
+        self.text: str | None = None if has_choice else "".join(buf)
+
+    def render(self, rand: Random) -> str:
+        if self.text is not None:
+            return self.text
+        return "".join(
+            [p if isinstance(p, str) else rand.choices(p)[0] for p in self.parts]
+        )
+
+
+def compile_template(value: str, prefix: list[str] | None = None) -> Template:
+    # prefixがNoneなら$var/%tagを展開しない
+    if prefix is not None:
+        value = expand_var_refs(value, prefix)
+    value = COMMENT_PATTERN.sub("", value)
+    tokens: list[Token] = []
+    pos = 0
+    for m in CHOICE_PATTERN.finditer(value):
+        tokens += tokenize_text(value[pos : m.start()])
+        tokens += [("choice", m.group(1).split("|"))]
+        pos = m.end()
+    tokens += tokenize_text(value[pos:])
+    return Template(tokens)
+
+
+# ライブラリごとのテンプレートキャッシュ (値, 展開時のキー) -> Template
+class TemplateCache:
+    def __init__(self, max_entries: int = 65536):
+        self.templates = LRUCache(max_bytes=1 << 62, max_entries=max_entries)
+
+    def get(self, value: str, prefix: list[str]) -> Template:
+        return self.templates.get_or_create(
+            (value, tuple(prefix)), lambda: (compile_template(value, prefix), 1)
+        )
@@ -0,0 +1,239 @@
+from typing import Any, Iterator
+
+import re
+from html.parser import HTMLParser
+
+# key_name_list用の字句解析・構文解析
+# HTMLParserと同じイベント列になる範囲の構文だけを扱い、それ以外はNoneを返してHTMLParserに任せる
+
+TAG_NAME = r"[a-zA-Z][-a-zA-Z0-9_]*"
+WS = r"[ \t\n\r\f]"
+ATTR = (
+    rf"{WS}+([^\s/>=<'\"&][^\s/>=<'\"&]*)"
+    rf"(?:=(\"[^\"<>&]*\"|'[^'<>&]*'|[^\s/>=<'\"&`]+(?={WS}|>|\Z)))?"
+)
+START_TAG = re.compile(rf"<({TAG_NAME})((?:{ATTR})*){WS}*(?P<close>/?)>")
+ATTR_PATTERN = re.compile(ATTR)
+END_TAG = re.compile(rf"</({TAG_NAME})>")
+LORA_TAG_PATTERN = re.compile(
+    r"<(lora[_a-z]*):([^:>]+):([0-9\-.]+)(:([0-9\-.]+))?>", flags=re.MULTILINE
+)
+
+# 内容を別の規則で解析するタグ
+RAW_TEXT_TAGS = (
+    "script",
+    "style",
+    "textarea",
+    "title",
+    "xmp",
+    "iframe",
+    "noembed",
+    "noframes",
+    "noscript",
+    "plaintext",
+)
+
+
+class Text:
+    __slots__ = ("data", "pos")
+
+    def __init__(self, data: str, pos: int):
+        self.data = data
+        self.pos = pos
+
+    def __repr__(self) -> str:
+        return f"Text({self.data!r}, {self.pos})"
+
+
+class Pi:
+    __slots__ = ("data", "pos")
+
+    def __init__(self, data: str, pos: int):
+        self.data = data
+        self.pos = pos
+
+    def __repr__(self) -> str:
+        return f"Pi({self.data!r}, {self.pos})"
+
+
+# 対応する開始タグのない終了タグ
+class EndTag:
+    __slots__ = ("name", "pos")
+
+    def __init__(self, name: str, pos: int):
+        self.name = name
+        self.pos = pos
+
+    def __repr__(self) -> str:
+        return f"EndTag({self.name!r}, {self.pos})"
+
+
+class Element:
+    __slots__ = ("name", "attrs", "pos", "children", "closed", "self_closing")
+
+    def __init__(
+        self,
+        name: str,
+        attrs: list[tuple[str, str | None]],
+        pos: int,
+        self_closing: bool = False,
+    ):
+        self.name = name
+        self.attrs = attrs
+        self.pos = pos
+        self.children: list[Node] = []
+        # 終了タグがあるか (なければ終了イベントを発生させない)
+        self.closed = self_closing
+        self.self_closing = self_closing
+
+    def __repr__(self) -> str:
+        return f"Element({self.name!r}, {self.attrs!r}, {self.pos}, {self.children!r})"
+
+
+type Node = Text | Pi | EndTag | Element
+type Attrs = list[tuple[str, str | None]]
+# ("start", タグ, 属性) ("end", タグ) ("data", 文字列) ("pi", 文字列)
+type Event = tuple[str, str] | tuple[str, str, Attrs]
+
+
+def parse_attrs(s: str) -> list[tuple[str, str | None]]:
+    r: list[tuple[str, str | None]] = []
+    for m in ATTR_PATTERN.finditer(s):
+        name, value = m.group(1), m.group(2)
+        if value is not None and value[:1] in ["'", '"']:
+            value = value[1:-1]
+        r += [(name.lower(), value)]
+    return r
+
+
+def expand_lora_tags(data: str) -> str:
+    # <lora:name:1.0> -> <?lora "name" "1.0">
+    def replace(m: re.Match[str]) -> str:
+        if m.group(5) is not None:
+            return f'<?{m.group(1)} "{m.group(2)}" "{m.group(3)}" "{m.group(5)}">'
+        else:
+            return f'<?{m.group(1)} "{m.group(2)}" "{m.group(3)}">'
+
+    return LORA_TAG_PATTERN.sub(replace, data)
+
+
+def parse_key_list(data: str) -> list[Node] | None:
+    if "&" in data:
+        # 文字参照はHTMLParserに任せる
+        return None
+    root: list[Node] = []
+    stack: list[Element] = []
+    children = root
+    pos = 0
+    n = len(data)
+    while pos < n:
+        j = data.find("<", pos)
+        if j < 0:
+            j = n
+        if pos < j:
+            children += [Text(data[pos:j], pos)]
+        if j == n:
+            break
+        pos = j
+        if data.startswith("<?", pos):
+            k = data.find(">", pos + 2)
+            if k < 0:
+                return None
+            children += [Pi(data[pos + 2 : k], pos)]
+            pos = k + 1
+        elif data.startswith("</", pos):
+            m = END_TAG.match(data, pos)
+            if m is None:
+                return None
+            name = m.group(1).lower()
+            if stack and stack[-1].name == name:
+                stack[-1].closed = True
+                stack.pop()
+                children = stack[-1].children if stack else root
+            else:
+                children += [EndTag(name, pos)]
+            pos = m.end()
+        else:
+            m = START_TAG.match(data, pos)
+            if m is None:
+                return None
+            name = m.group(1).lower()
+            if name in RAW_TEXT_TAGS:
+                return None
+            element = Element(
+                name, parse_attrs(m.group(2)), pos, m.group("close") == "/"
+            )
+            children += [element]
+            if not element.self_closing:
+                stack += [element]
+                children = element.children
+            pos = m.end()
+    return root
+
+
+def to_events(nodes: list[Node]) -> list[Event]:
+    # 自己終了タグは開始・終了の2つのイベントにする (HTMLParserと同じ)
+    r: list[Event] = []
+    stack: list[tuple[Iterator[Node], Element | None]] = [(iter(nodes), None)]
+    while stack:
+        it, parent = stack[-1]
+        node = next(it, None)
+        if node is None:
+            stack.pop()
+            if parent is not None and parent.closed:
+                r += [("end", parent.name)]
+        elif isinstance(node, Text):
+            r += [("data", node.data)]
+        elif isinstance(node, Pi):
+            r += [("pi", node.data)]
+        elif isinstance(node, EndTag):
+            r += [("end", node.name)]
+        elif node.self_closing:
+            r += [("start", node.name, node.attrs), ("end", node.name)]
+        else:
+            r += [("start", node.name, node.attrs)]
+            stack += [(iter(node.children), node)]
+    return r
+
+
+# 専用の構文解析で扱えない入力のイベントをHTMLParserで記録する
+class EventRecorder(HTMLParser):
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.events: list[Event] = []
+
+    def handle_starttag(self, tag: str, attrs: Attrs):
+        self.events += [("start", tag, attrs)]
+
+    def handle_endtag(self, tag: str):
+        self.events += [("end", tag)]
+
+    def handle_data(self, data: str):
+        self.events += [("data", data)]
+
+    def handle_pi(self, data: str):
+        self.events += [("pi", data)]
+
+
+def parse_events(data: str) -> list[Event]:
+    nodes = parse_key_list(data)
+    if nodes is None:
+        recorder = EventRecorder()
+        recorder.feed(data)
+        return recorder.events
+    return to_events(nodes)
+
+
+def dump_nodes(nodes: list[Node]) -> list[Any]:
+    # デバッグ・テスト用
+    r: list[Any] = []
+    for node in nodes:
+        if isinstance(node, Element):
+            r += [(node.name, node.attrs, dump_nodes(node.children), node.closed)]
+        elif isinstance(node, EndTag):
+            r += [("/" + node.name,)]
+        elif isinstance(node, Pi):
+            r += [("?", node.data)]
+        else:
+            r += [node.data]
+    return r
@@ -0,0 +1,93 @@
+from typing import Any, Generator, TextIO
+
+import os
+import json
+import itertools
+import contextlib
+from collections import deque
+from contextvars import ContextVar
+
+# TOML_PROMPT_TRACE=1 で記録、=print で標準出力にも表示
+TRACE_ENV = "TOML_PROMPT_TRACE"
+
+# (連番, デコードID, 種類, 内容)
+type TraceEvent = tuple[int, int, str, dict[str, Any]]
+
+current_decode: ContextVar[int] = ContextVar("current_decode", default=0)
+
+
+def format_event(event: TraceEvent) -> str:
+    _, _, kind, data = event
+    return " ".join([f"{kind}:"] + [f"{k}={v}" for k, v in data.items()])
+
+
+def event_to_json(event: TraceEvent) -> str:
+    seq, decode_id, kind, data = event
+    return json.dumps(
+        {"seq": seq, "decode": decode_id, "kind": kind, **data},
+        ensure_ascii=False,
+        default=str,
+    )
+
+
+# デコード中の処理を固定長のリングバッファに記録する
+# 呼び出し側は `if tracer.enabled:` で囲み、無効時は引数の構築もしない
+class Tracer:
+    def __init__(self, capacity: int = 4096, enabled: bool = False, echo: bool = False):
+        self.enabled = enabled
+        self.echo = echo
+        self.events: deque[TraceEvent] = deque(maxlen=capacity)
+        self.seq = itertools.count(1)
+        self.decode_ids = itertools.count(1)
+
+    def configure(
+        self,
+        enabled: bool | None = None,
+        capacity: int | None = None,
+        echo: bool | None = None,
+    ):
+        if capacity is not None and capacity != self.events.maxlen:
+            self.events = deque(self.events, maxlen=capacity)
+        if echo is not None:
+            self.echo = echo
+        if enabled is not None:
+            self.enabled = enabled
+
+    def new_decode(self) -> int:
+        return next(self.decode_ids)
+
+    @contextlib.contextmanager
+    def scope(self, decode_id: int) -> Generator[int, None, None]:
+        token = current_decode.set(decode_id)
+        try:
+            yield decode_id
+        finally:
+            current_decode.reset(token)
+
+    def emit(self, kind: str, **data: Any):
+        event = (next(self.seq), current_decode.get(), kind, data)
+        self.events.append(event)
+        if self.echo:
+            print(format_event(event))
+
+    def get(self, decode_id: int | None = None) -> list[TraceEvent]:
+        events = list(self.events)
+        if decode_id is None:
+            return events
+        return [e for e in events if e[1] == decode_id]
+
+    def dump_jsonl(self, f: TextIO, decode_id: int | None = None):
+        for event in self.get(decode_id):
+            f.write(event_to_json(event) + "\n")
+
+    def to_jsonl(self, decode_id: int | None = None) -> str:
+        return "".join([event_to_json(e) + "\n" for e in self.get(decode_id)])
+
+    def clear(self):
+        self.events.clear()
+
+
+tracer = Tracer(
+    enabled=os.environ.get(TRACE_ENV, "") not in ["", "0"],
+    echo=os.environ.get(TRACE_ENV, "") == "print",
+)
@@ -1,4 +1,19 @@
+import os
 import random
+import hashlib
+import itertools
+from collections import deque
+
+from .trace import tracer
+
+# mt: random.Randomと同じ乱数列 (既存のシードを再現する)
+# splitmix: SplitMix64 _random_countの読み飛ばしがO(1)だが結果はmtと異なる
+RNGS = ("mt", "splitmix")
+RNG_KEY = "_rng"
+
+MASK64 = 0xFFFFFFFFFFFFFFFF
+GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+RECIP_BPF = 2.0**-53
 
 
 class Random(random.Random):
@@ -7,11 +22,63 @@ class Random(random.Random):
         self.count = 0
 
     def set_count(self, count: int):
-        print(f"RandomCount: {self.count} -> {count}")
+        if tracer.enabled:
+            tracer.emit("random_count", count=self.count, to=count)
         assert count >= self.count
-        _rands = [self.random() for _i in range(self.count, count)]
+        # 捨てる乱数はカウントせずCのループで生成する
+        n = count - self.count
+        deque(itertools.islice(iter(super().random, None), n), maxlen=0)
         self.count = 0
 
     def random(self) -> float:
         self.count += 1
         return super().random()
+
+
+# n番目の値がシードとnだけで決まるので、読み飛ばしは添字の加算で済む
+class CounterRandom(Random):
+    def __init__(self, seed: int | None):
+        # Random.__init__のcountは使わず、添字の差から求める
+        random.Random.__init__(self, seed)
+
+    def seed(
+        self, a: int | float | str | bytes | bytearray | None = None, version: int = 2
+    ):
+        if a is None:
+            a = int.from_bytes(os.urandom(8))
+        elif isinstance(a, float):
+            a = hash(a)
+        elif not isinstance(a, int):
+            # strのhashは実行ごとに変わるので、random.Randomと同じくsha512で整数にする
+            b = a.encode("utf-8") if isinstance(a, str) else bytes(a)
+            a = int.from_bytes(b + hashlib.sha512(b).digest())
+        self.key = a & MASK64
+        self.index = 0
+        self.mark = 0
+
+    @property
+    def count(self) -> int:
+        return self.index - self.mark
+
+    def set_count(self, count: int):
+        if tracer.enabled:
+            tracer.emit("random_count", count=self.count, to=count)
+        assert count >= self.count
+        self.index = self.mark = self.mark + count
+
+    def random(self) -> float:
+        self.index = i = self.index + 1
+        z = (self.key + i * GOLDEN_GAMMA) & MASK64
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+        return ((z ^ (z >> 31)) >> 11) * RECIP_BPF
+
+    def getstate(self):
+        return (self.key, self.index, self.mark)
+
+    def setstate(self, state: tuple[int, int, int]):
+        self.key, self.index, self.mark = state
+
+
+def new_random(seed: int | None, rng: str = RNGS[0]) -> Random:
+    return CounterRandom(seed) if rng == "splitmix" else Random(seed)
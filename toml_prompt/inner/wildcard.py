@@ -0,0 +1,138 @@
+from typing import Iterator, Sequence, overload
+
+import os
+import array
+import struct
+
+INDEX_MAGIC = b"TPIDX"
+INDEX_VERSION = 1
+INDEX_EXT = ".tpi"
+
+# magic, バージョン, ソースのサイズ, ソースのmtime_ns
+HEADER = struct.Struct(f"<{len(INDEX_MAGIC)}sHqq")
+
+
+def is_valid_line(line: str) -> bool:
+    return not line.startswith("#") and not line.startswith("//")
+
+
+def build_line_index(path: str) -> array.array[int]:
+    # 有効な行の(開始, 終了)バイトオフセットを交互に並べる
+    offsets = array.array("q")
+    pos = 0
+    with open(path, "rb") as f:
+        for raw in f:
+            end = pos + len(raw)
+            if is_valid_line(raw.decode("utf-8").strip()):
+                offsets.append(pos)
+                offsets.append(end)
+            pos = end
+    return offsets
+
+
+def load_line_index(
+    index_path: str, size: int, mtime_ns: int
+) -> array.array[int] | None:
+    try:
+        with open(index_path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) < HEADER.size:
+        return None
+    magic, version, index_size, index_mtime_ns = HEADER.unpack_from(data)
+    if (
+        magic != INDEX_MAGIC
+        or version != INDEX_VERSION
+        or index_size != size
+        or index_mtime_ns != mtime_ns
+    ):
+        return None
+    offsets = array.array("q")
+    try:
+        offsets.frombytes(data[HEADER.size :])
+    except ValueError:
+        return None
+    return offsets
+
+
+def save_line_index(
+    index_path: str, size: int, mtime_ns: int, offsets: array.array[int]
+):
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(INDEX_MAGIC, INDEX_VERSION, size, mtime_ns))
+            f.write(offsets.tobytes())
+        os.replace(tmp_path, index_path)
+    except OSError:
+        pass
+
+
+# _load_from_fileの行リスト
+# 有効行のオフセットだけをメモリに持ち、選ばれた行だけをファイルから読む
+class WildcardFile(Sequence[str]):
+    persist_index = True
+
+    def __init__(self, path: str):
+        st = os.stat(path)
+        self.path = path
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        index_path = path + INDEX_EXT
+        offsets = load_line_index(index_path, self.size, self.mtime_ns)
+        if offsets is None:
+            offsets = build_line_index(path)
+            if self.persist_index:
+                save_line_index(index_path, self.size, self.mtime_ns, offsets)
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) // 2
+
+    def read_line(self, i: int) -> str:
+        begin = self.offsets[i * 2]
+        end = self.offsets[i * 2 + 1]
+        # ファイルを開いたままにしないのでロックされず編集できる
+        with open(self.path, "rb") as f:
+            f.seek(begin)
+            return f.read(end - begin).decode("utf-8").strip()
+
+    @overload
+    def __getitem__(self, i: int) -> str: ...
+
+    @overload
+    def __getitem__(self, i: slice) -> list[str]: ...
+
+    def __getitem__(self, i: int | slice) -> str | list[str]:
+        if isinstance(i, slice):
+            return [self.read_line(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("WildcardFile index out of range")
+        return self.read_line(i)
+
+    def __iter__(self) -> Iterator[str]:
+        with open(self.path, "rb") as f:
+            for i in range(len(self)):
+                begin = self.offsets[i * 2]
+                f.seek(begin)
+                yield f.read(self.offsets[i * 2 + 1] - begin).decode("utf-8").strip()
+
+    def read_all(self) -> list[str]:
+        # 全行をまとめて読む (<?grep>用)
+        with open(self.path, "rb") as f:
+            data = f.read()
+        lines = data.decode("utf-8").split("\n")
+        if lines[-1] == "":
+            lines.pop()
+        # is_valid_lineと同じ判定 (関数呼び出しを避ける)
+        r = [v for v in map(str.strip, lines) if not v.startswith(("#", "//"))]
+        if len(r) != len(self):
+            # 索引の作成後に変更された
+            return list(self)
+        return r
+
+    def nbytes(self) -> int:
+        return self.offsets.itemsize * len(self.offsets)
@@ -1,11 +1,18 @@
 import os
-import hashlib
 
 from .inner.prompt import PromptFile
+from .inner.fingerprint import fingerprints
+from .inner.directory_index import DirectoryIndex
+from .inner.sqlite_store import SQLITE_EXTS
 
 base_path: str = os.path.realpath(
     os.path.join(os.path.dirname(__file__), "..", "prompts")
 )
+prompt_index = DirectoryIndex(
+    base_path,
+    (".txt", ".toml", ".yaml", ".yml") + SQLITE_EXTS,
+    index_path=os.path.join(os.path.dirname(base_path), ".prompt_index.json"),
+)
 
 
 class PromptLoader:
@@ -17,9 +24,7 @@ class PromptLoader:
 
     @classmethod
     def INPUT_TYPES(cls):
-        files: list[str] = []
-        for _, _, fs in os.walk(base_path):
-            files += [f for f in fs if f.endswith((".txt", ".toml", ".yaml", ".yml"))]
+        files = prompt_index.refresh()
         return {
             "required": {
                 "file": (files, {"tooltip": "file name."}),
@@ -28,16 +33,13 @@ class PromptLoader:
 
     @classmethod
     def IS_CHANGED(cls, file: str):
-        path = os.path.join(base_path, file)
-        m = hashlib.sha256()
-        with open(path, "rb") as f:
-            m.update(f.read())
-        return m.digest().hex()
+        path = os.path.join(base_path, prompt_index.resolve(file))
+        return fingerprints.fingerprint(path)
 
     def __init__(self):
         pass
 
     def load_prompt(self, file: str):
-        path = os.path.join(base_path, file)
+        path = os.path.join(base_path, prompt_index.resolve(file))
         prompt = PromptFile(path)
         return (prompt,)
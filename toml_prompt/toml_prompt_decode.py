@@ -1,14 +1,14 @@
+from typing import Iterable, Iterator
+
 import re
 import json
 
 from . import InputTypesFuncResult
-from .inner.prompt import (
-    PromptFile,
-    export_values,
-    select_dynamic_prompt,
-    remove_comment_out,
-)
+from .inner.prompt import PromptFile, PromptLibrary, export_values
 from .inner.parser import PromptTagParser
+from .inner.trace import tracer
+
+SEED_MAX = 0xFFFFFFFFFFFFFFFF
 
 
 def load_summary_header(s: str):
@@ -18,14 +18,6 @@ def load_summary_header(s: str):
     return r
 
 
-def normalize_prompt(s: str):
-    s = re.sub(r"\s+", " ", s)
-    s = re.sub(r", ", ",", s)
-    s = re.sub(r",+", ",", s)
-    s = re.sub(r"\.,", ".", s)
-    return s[1:] if s.startswith(",") else s
-
-
 class PromptDecode:
     RETURN_TYPES = ("STRING", "STRING", "STRING", "INT", "STRING", "STRING")
     OUTPUT_TOOLTIPS = (
@@ -57,7 +49,7 @@ class PromptDecode:
                     {
                         "default": 0,
                         "min": 0,
-                        "max": 0xFFFFFFFFFFFFFFFF,
+                        "max": SEED_MAX,
                         "tooltip": "Random seed.",
                     },
                 ),
@@ -70,38 +62,200 @@ class PromptDecode:
                         "tooltip": "TOML format prompt.",
                     },
                 ),
-            }
+            },
+            "optional": {
+                "dedupe_tags": (
+                    "BOOLEAN",
+                    {
+                        "default": False,
+                        "tooltip": "Drop duplicate tags, keeping the first occurrence.",
+                    },
+                ),
+            },
         }
 
     def __init__(self):
         pass
 
-    def load_prompt(self, seed: int, toml: PromptFile, key_name_list: str):
-        parser = PromptTagParser(prompt=toml, seed=seed)
-        parser.exports = {"prompt_seed": f"{seed}"}
-        export_values(parser.prompt_dict, parser.exports, ".", [])
+    def load_prompt(
+        self,
+        seed: int,
+        toml: PromptFile,
+        key_name_list: str,
+        dedupe_tags: bool = False,
+    ):
+        return decode_prompt(seed, toml, key_name_list, dedupe_tags)
 
-        key_name_list = select_dynamic_prompt(
-            parser.random, remove_comment_out(key_name_list)
-        )
 
-        # Decode
-        parser.feed(key_name_list)
-        positive = normalize_prompt(
-            ",".join([v.strip() for v in parser.positive if v.strip()])
+class PromptDecodeBatch:
+    RETURN_TYPES = PromptDecode.RETURN_TYPES
+    OUTPUT_IS_LIST = (True, True, True, True, True, True)
+    OUTPUT_TOOLTIPS = PromptDecode.OUTPUT_TOOLTIPS
+    FUNCTION = "load_prompts"
+    CATEGORY = "utils"
+    DESCRIPTION = "Load prompts for multiple seeds."
+
+    @classmethod
+    def INPUT_TYPES(cls) -> InputTypesFuncResult:
+        return {
+            "required": {
+                "key_name_list": (
+                    "STRING",
+                    {
+                        "multiline": True,
+                        "dynamicPrompts": True,
+                        "tooltip": "Select Key Name",
+                    },
+                ),
+                "seed": (
+                    "INT",
+                    {
+                        "default": 0,
+                        "min": 0,
+                        "max": SEED_MAX,
+                        "tooltip": "First random seed.",
+                    },
+                ),
+                "count": (
+                    "INT",
+                    {
+                        "default": 4,
+                        "min": 1,
+                        "max": 4096,
+                        "tooltip": "Number of prompts.",
+                    },
+                ),
+                "stride": (
+                    "INT",
+                    {
+                        "default": 1,
+                        "min": 1,
+                        "max": SEED_MAX,
+                        "tooltip": "Seed increment between prompts.",
+                    },
+                ),
+                "toml": (
+                    "PROMPT_FILE",
+                    {
+                        "multiline": True,
+                        "dynamicPrompts": True,
+                        "defaultInput": True,
+                        "tooltip": "TOML format prompt.",
+                    },
+                ),
+            },
+            "optional": {
+                "dedupe_tags": (
+                    "BOOLEAN",
+                    {
+                        "default": False,
+                        "tooltip": "Drop duplicate tags, keeping the first occurrence.",
+                    },
+                ),
+            },
+        }
+
+    def __init__(self):
+        pass
+
+    def load_prompts(
+        self,
+        seed: int,
+        count: int,
+        stride: int,
+        toml: PromptFile,
+        key_name_list: str,
+        dedupe_tags: bool = False,
+    ):
+        results = [
+            r.to_tuple()
+            for r in iter_decode(
+                toml, key_name_list, batch_seeds(seed, count, stride), dedupe_tags
+            )
+        ]
+        return tuple(list(r) for r in zip(*results))
+
+
+def batch_seeds(seed: int, count: int, stride: int) -> list[int]:
+    return [(seed + i * stride) & SEED_MAX for i in range(count)]
+
+
+class DecodeResult:
+    __slots__ = ("positive", "negative", "lora_list", "seed", "summary", "exports")
+
+    def __init__(
+        self,
+        positive: str,
+        negative: str,
+        lora_list: str,
+        seed: int,
+        summary: str,
+        exports: str,
+    ):
+        self.positive = positive
+        self.negative = negative
+        self.lora_list = lora_list
+        self.seed = seed
+        self.summary = summary
+        self.exports = exports
+
+    def to_tuple(self) -> tuple[str, str, str, int, str, str]:
+        # PromptDecode.load_prompt の戻り値と同じ形
+        return (
+            self.positive,
+            self.negative,
+            self.lora_list,
+            self.seed,
+            self.summary,
+            self.exports,
         )
-        negative = normalize_prompt(
-            ",".join([v.strip() for v in parser.negative if v.strip()])
+
+
+def iter_decode(
+    prompt_file: str | PromptFile,
+    key_name_list: str,
+    seeds: Iterable[int],
+    dedupe_tags: bool = False,
+) -> Iterator[DecodeResult]:
+    # ライブラリとデコード計画は全シードで共有し、シードは必要な分だけ読む
+    toml = PromptFile(prompt_file) if isinstance(prompt_file, str) else prompt_file
+    library = toml.load_library()
+    for seed in seeds:
+        yield DecodeResult(
+            *decode_prompt(seed, toml, key_name_list, dedupe_tags, library)
         )
 
-        lora_list = "\n".join(parser.loras)
-        if parser.loras_low:
-            lora_list += "\n--\n"
-            lora_list += "\n".join(parser.loras_low)
-        exports = "\n".join(["{}: {}".format(k, v) for k, v in parser.exports.items()])
-        summary = f"{exports}\n\n---- Positive ----\n{positive}\n\n---- Negative ----\n{negative}\n\n---- LoRA ----\n{lora_list}"
-        exports = json.dumps(load_summary_header(exports))
-        return (positive, negative, lora_list, seed, summary, exports)
+
+def decode_prompt(
+    seed: int,
+    toml: PromptFile,
+    key_name_list: str,
+    dedupe_tags: bool = False,
+    library: PromptLibrary | None = None,
+) -> tuple[str, str, str, int, str, str]:
+    if library is None:
+        library = toml.load_library()
+    parser = PromptTagParser(prompt=toml, seed=seed, library=library)
+    parser.exports = {"prompt_seed": f"{seed}"}
+    with tracer.scope(parser.decode_id):
+        export_values(parser.prompt_dict, parser.exports, ".", [])
+
+    # シードに依存しない処理は計画としてキャッシュされる
+    plan = library.plans.get(key_name_list)
+
+    # Decode
+    parser.feed_events(plan.render(parser.random))
+    positive = parser.positive.build(dedupe_tags)
+    negative = parser.negative.build(dedupe_tags)
+
+    lora_list = "\n".join(parser.loras)
+    if parser.loras_low:
+        lora_list += "\n--\n"
+        lora_list += "\n".join(parser.loras_low)
+    exports = "\n".join(["{}: {}".format(k, v) for k, v in parser.exports.items()])
+    summary = f"{exports}\n\n---- Positive ----\n{positive}\n\n---- Negative ----\n{negative}\n\n---- LoRA ----\n{lora_list}"
+    exports = json.dumps(load_summary_header(exports))
+    return (positive, negative, lora_list, seed, summary, exports)
 
 
 class SummaryReader: